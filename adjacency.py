@@ -0,0 +1,255 @@
+#
+# adjacency.py
+#
+# Defines class adjacency, indexes of the neighborhoods within a
+# mesh, built once from its connectivity so that they can be looked
+# up without walking the half-edges one at a time.
+#
+# Each index is kept in compressed sparse row (CSR) form: a list of
+# entries for every vertex (or face), all laid end to end in one
+# array, with an array of offsets giving where each one's entries
+# start.  The entries of vertex v are
+#
+#     values[offsets[v]:offsets[v+1]]
+#
+# The indexes, each built the first time it's needed, are
+#
+#   * fans: the out edges of each vertex, in the order its fan is
+#           walked (see mesh.fans)
+#   * outs: all the out edges of each vertex, by id, even those
+#           its fan walk doesn't reach
+#   * neighbors: the vertices sharing an edge with each vertex, by id
+#   * faces: the faces sharing an edge with each face, by id
+#
+# and across gives, for each face, the face across each of its three
+# edges, or -1 where an edge has no twin.
+#
+# The rows of many vertices or faces can be gathered at once with
+# gather, and their k-ring neighborhoods found with ring and rings.
+#
+
+import numpy as np
+
+class adjacency:
+
+    #
+    # adjacency(mesh):
+    #
+    # Starts the indexes of the given mesh.  The fans index is built
+    # right away, since computing and smoothing normals need it; the
+    # others are built the first time they're asked for.
+    #
+    # Instance attributes:
+    #
+    #   * mesh: the mesh indexed
+    #   * fan_offsets, fan_edges: the fans index
+    #   * built: the other indexes built so far, by name
+    #
+    def __init__(self,mesh):
+        self.mesh = mesh
+        centers, edges = mesh.walk_fans()
+        self.fan_offsets = offsets_for(centers,mesh.vertex_count())
+        self.fan_edges = edges[np.argsort(centers,kind='stable')]
+        self.built = { }
+
+    #
+    # self.outs(), self.neighbors(), self.faces():
+    #
+    # The outs, neighbors, and faces indexes, each as the arrays
+    # (offsets, values).
+    #
+    def outs(self):
+        if 'outs' not in self.built:
+            sources = self.mesh.source
+            self.built['outs'] = (offsets_for(sources,
+                                              self.mesh.vertex_count()),
+                                  np.argsort(sources,kind='stable'))
+        return self.built['outs']
+
+    def neighbors(self):
+        if 'neighbors' not in self.built:
+            M = self.mesh
+            n = M.vertex_count()
+            sources = M.source.astype(np.int64)
+            targets = sources[M.next]
+
+            # Each edge joins its two vertices both ways.  (An edge
+            # from a vertex to itself doesn't make it its own
+            # neighbor.)
+            apart = sources != targets
+            pairs = distinct(np.concatenate([
+                sources[apart] * n + targets[apart],
+                targets[apart] * n + sources[apart]]))
+            self.built['neighbors'] = (offsets_for(pairs // n,n), pairs % n)
+        return self.built['neighbors']
+
+    def faces(self):
+        if 'faces' not in self.built:
+            t = self.mesh.face_count()
+            across = self.across().ravel()
+            rows = np.repeat(np.arange(t),3)
+            linked = (across >= 0) & (across != rows)
+            pairs = distinct(rows[linked] * t + across[linked])
+            self.built['faces'] = (offsets_for(pairs // max(t,1),t),
+                                   pairs % max(t,1))
+        return self.built['faces']
+
+    #
+    # self.across():
+    #
+    # A t x 3 array giving the face across each edge of each face, or
+    # -1 where the edge has no twin.
+    #
+    def across(self):
+        if 'across' not in self.built:
+            M = self.mesh
+            twins = M.twin.astype(np.int64)
+            self.built['across'] = np.where(
+                twins >= 0,M.face[np.maximum(twins,0)],-1).reshape(-1,3)
+        return self.built['across']
+
+    #
+    # self.fans():
+    #
+    # The fans index as the arrays (centers, edges) given by
+    # mesh.fans: the vertex and the edge of each step of the walks,
+    # each vertex's steps in order.
+    #
+    def fans(self):
+        counts = np.diff(self.fan_offsets)
+        return (np.repeat(np.arange(len(counts)),counts), self.fan_edges)
+
+    #
+    # self.fan(v), self.out(v), self.vertex_neighbors(v),
+    # self.face_neighbors(f):
+    #
+    # The row of a single vertex or face in each index.
+    #
+    def fan(self,v):
+        return self.fan_edges[self.fan_offsets[v]:self.fan_offsets[v+1]]
+
+    def out(self,v):
+        offsets, edges = self.outs()
+        return edges[offsets[v]:offsets[v+1]]
+
+    def vertex_neighbors(self,v):
+        offsets, neighbors = self.neighbors()
+        return neighbors[offsets[v]:offsets[v+1]]
+
+    def face_neighbors(self,f):
+        offsets, faces = self.faces()
+        return faces[offsets[f]:offsets[f+1]]
+
+    #
+    # self.vertex_ring(vertices,k=1), self.face_ring(faces,k=1):
+    #
+    # The ids of all the vertices (or faces) within k steps of any of
+    # those given, them included, in order.
+    #
+    def vertex_ring(self,vertices,k=1):
+        return ring(*self.neighbors(),vertices,k)
+
+    def face_ring(self,faces,k=1):
+        return ring(*self.faces(),faces,k)
+
+    #
+    # self.vertex_rings(vertices,k=1), self.face_rings(faces,k=1):
+    #
+    # The k-ring of each of the given vertices (or faces) on its own,
+    # as an index (offsets, ids) with a row for each.
+    #
+    def vertex_rings(self,vertices,k=1):
+        return rings(*self.neighbors(),vertices,k)
+
+    def face_rings(self,faces,k=1):
+        return rings(*self.faces(),faces,k)
+
+    #
+    # self.nbytes():
+    #
+    # The number of bytes taken by the indexes built so far.
+    #
+    def nbytes(self):
+        arrays = [self.fan_offsets, self.fan_edges]
+        for index in self.built.values():
+            arrays.extend(index if isinstance(index,tuple) else [index])
+        return sum(a.nbytes for a in arrays)
+
+#
+# offsets_for(rows,count):
+#
+# The offsets of an index with the given number of rows, whose
+# entries, sorted by row, belong to the given rows.
+#
+def offsets_for(rows,count):
+    offsets = np.zeros(count + 1,dtype=np.int64)
+    np.cumsum(np.bincount(rows,minlength=count),out=offsets[1:])
+    return offsets
+
+#
+# distinct(keys):
+#
+# The distinct values of the given array of keys, in order.
+#
+def distinct(keys):
+    keys = np.sort(keys)
+    return keys[np.concatenate([[True],keys[1:] != keys[:-1]])]
+
+#
+# gather(offsets,values,ids):
+#
+# Gathers the rows of the index (offsets, values) for the given ids,
+# giving back the arrays (which, found): each entry found, and the
+# position within ids of the row it came from.
+#
+def gather(offsets,values,ids):
+    ids = np.asarray(ids,dtype=np.int64).ravel()
+    starts = offsets[ids]
+    counts = offsets[ids + 1] - starts
+    which = np.repeat(np.arange(len(ids)),counts)
+    at = np.repeat(starts - (np.cumsum(counts) - counts),counts) \
+         + np.arange(len(which))
+    return (which, values[at])
+
+#
+# ring(offsets,values,ids,k):
+#
+# The ids within k steps of any of the given ids in the index
+# (offsets, values), taken as a graph, in order.
+#
+def ring(offsets,values,ids,k):
+    reached = np.zeros(len(offsets) - 1,dtype=bool)
+    frontier = distinct(np.asarray(ids,dtype=np.int64).ravel())
+    reached[frontier] = True
+    for step in range(k):
+        found = gather(offsets,values,frontier)[1]
+        frontier = distinct(found[~reached[found]])
+        if len(frontier) == 0:
+            break
+        reached[frontier] = True
+    return np.flatnonzero(reached)
+
+#
+# rings(offsets,values,ids,k):
+#
+# The ids within k steps of each of the given ids in the index
+# (offsets, values), taken as a graph, as an index (offsets, ids)
+# with a row for each, in order.
+#
+# All the rings are grown together, as sorted arrays of keys
+# row * n + id, n being the number of ids in the graph.
+#
+def rings(offsets,values,ids,k):
+    n = len(offsets) - 1
+    ids = np.asarray(ids,dtype=np.int64).ravel()
+    reached = np.arange(len(ids)) * n + ids
+    frontier = reached
+    for step in range(k):
+        which, found = gather(offsets,values,frontier % n)
+        found = distinct(frontier[which] // n * n + found)
+        at = np.minimum(np.searchsorted(reached,found),len(reached) - 1)
+        frontier = found[reached[at] != found]
+        if len(frontier) == 0:
+            break
+        reached = np.sort(np.concatenate([reached,frontier]))
+    return (offsets_for(reached // n,len(ids)), reached % n)
@@ -0,0 +1,227 @@
+#
+# bench.py
+#
+# A benchmark runner for the stages of loading, drawing, and picking
+# a scene, run over the models in objs/.  For each model, the stages
+# of an uncached scene.read are run one at a time,
+#
+#   parse, build (the half-edges), set_first_edges, normals,
+#   smooth_normals, rebox
+#
+# followed by
+#
+#   compile (as lists), compile_indexed (as buffers), bvh (building
+#   the hierarchy used for picking), intersect_ray (a fixed grid of
+#   picking rays), adjacency (building the out edge, neighbor, and
+#   face neighbor indexes)
+#
+# and each stage's wall time, peak memory, and the number of Python
+# objects it leaves behind are recorded.  Memory and objects are
+# measured on a first run, under tracemalloc, and times are the best
+# of a number of further runs.
+#
+# The results are written as JSON, and can be compared against the
+# results of an earlier run to flag regressions:
+#
+#   python3 bench.py -o results.json
+#   python3 bench.py --compare results.json
+#
+
+import argparse
+import contextlib
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from geometry import point, vector
+from scene import scene, vertex
+
+# The picking rays form a RAY_GRID x RAY_GRID grid over the viewing
+# square, all shot straight down the z axis, as object-view shoots
+# them for an unturned trackball.
+RAY_GRID = 16
+
+# A stage regresses when it gets slower (or bigger) by more than the
+# tolerance, and by more than the slack.
+TOLERANCE = 0.10
+TIME_SLACK = 0.001
+MEMORY_SLACK = 1 << 16
+
+#
+# stages(filename):
+#
+# The benchmarked stages for the given .obj file, as a list of
+# (name, function) pairs, to be called in order on an empty scene.
+#
+def stages(filename):
+    parsed = { }
+
+    def parse():
+        parsed['arrays'] = scene.parse(filename)
+
+    def build():
+        scene.build(*parsed.pop('arrays'))
+
+    def adjacency():
+        indexes = scene.mesh.adjacency()
+        indexes.outs()
+        indexes.neighbors()
+        indexes.faces()
+
+    def intersect_ray():
+        steps = np.linspace(-1.0,1.0,RAY_GRID)
+        down = vector(0.0,0.0,-1.0)
+        return sum(scene.intersect_ray(point(x,y,2.0),down) is not None
+                   for y in steps.tolist() for x in steps.tolist())
+
+    return [('parse', parse),
+            ('build', build),
+            ('set_first_edges', vertex.set_first_edges),
+            ('normals', lambda: scene.mesh.compute_normals()),
+            ('smooth_normals', vertex.smooth_normals),
+            ('rebox', scene.rebox),
+            ('compile', scene.compile),
+            ('compile_indexed', lambda: scene.compile(indexed=True)),
+            ('bvh', lambda: scene.mesh.bvh()),
+            ('intersect_ray', intersect_ray),
+            ('adjacency', adjacency)]
+
+#
+# run_model(filename,repeat):
+#
+# Benchmarks the stages for one model, giving back its results.
+#
+def run_model(filename,repeat):
+
+    # Measure memory on a run of its own, which also warms up.
+    results = { }
+    scene.clear()
+    gc.collect()
+    tracemalloc.start()
+    for name,stage in stages(filename):
+        objects = len(gc.get_objects())
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+        results[name] = {'seconds': None,
+                         'peak_bytes': peak - current,
+                         'objects': len(gc.get_objects()) - objects}
+    tracemalloc.stop()
+
+    for i in range(repeat):
+        scene.clear()
+        for name,stage in stages(filename):
+            start = time.perf_counter()
+            stage()
+            elapsed = time.perf_counter() - start
+            seconds = results[name]['seconds']
+            if seconds is None or elapsed < seconds:
+                results[name]['seconds'] = elapsed
+
+    M = scene.mesh
+    counts = {'vertices': M.vertex_count(),
+              'edges': M.edge_count(),
+              'faces': M.face_count(),
+              'bvh_nodes': M.bvh().node_count(),
+              'rays': RAY_GRID*RAY_GRID,
+              'mesh_bytes': M.nbytes()}
+    return {'counts': counts, 'stages': results}
+
+#
+# run(filenames,repeat):
+#
+# Benchmarks each of the given models, giving back all the results.
+#
+def run(filenames,repeat):
+    models = { }
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        # (keep the load's messages, like bad orientations, quiet)
+        with open(os.devnull,'w') as quiet, contextlib.redirect_stdout(quiet):
+            models[name] = run_model(filename,repeat)
+        print('%s: %s' % (name, ', '.join('%s %.4fs' % (stage,r['seconds'])
+                                          for stage,r in
+                                          models[name]['stages'].items())),
+              file=sys.stderr)
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'repeat': repeat,
+            'models': models}
+
+#
+# compare(results,baseline):
+#
+# Prints how each stage's time and peak memory changed since the
+# baseline results.  Returns the number of regressions.
+#
+def compare(results,baseline):
+    regressions = 0
+    print('%-8s %-16s %10s %10s %7s %12s %12s %7s' %
+          ('model','stage','base s','new s','ratio',
+           'base bytes','new bytes','ratio'))
+    for model,result in results['models'].items():
+        if model not in baseline['models']:
+            continue
+        old_stages = baseline['models'][model]['stages']
+        for stage,new in result['stages'].items():
+            if stage not in old_stages:
+                continue
+            old = old_stages[stage]
+            flags = []
+            if new['seconds'] > old['seconds']*(1.0 + TOLERANCE) + TIME_SLACK:
+                flags.append('SLOWER')
+            if new['peak_bytes'] > old['peak_bytes']*(1.0 + TOLERANCE) \
+                                   + MEMORY_SLACK:
+                flags.append('BIGGER')
+            regressions += len(flags)
+            print('%-8s %-16s %10.4f %10.4f %7.2f %12d %12d %7.2f %s' %
+                  (model, stage, old['seconds'], new['seconds'],
+                   new['seconds'] / max(old['seconds'],1e-9),
+                   old['peak_bytes'], new['peak_bytes'],
+                   new['peak_bytes'] / max(old['peak_bytes'],1),
+                   ' '.join(flags)))
+    return regressions
+
+
+def main(argc, argv):
+    """ Run the benchmarks, and save or compare the results. """
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scene stages over .obj models.')
+    parser.add_argument('models',nargs='*',
+                        help='.obj files to run (default: objs/*.obj)')
+    parser.add_argument('-o','--output',
+                        help='write the results to this JSON file')
+    parser.add_argument('-c','--compare',metavar='BASELINE',
+                        help='compare the results to this JSON file')
+    parser.add_argument('-r','--repeat',type=int,default=3,
+                        help='timed runs of each model (default: 3)')
+    args = parser.parse_args(argv[1:])
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    filenames = args.models or sorted(glob.glob('objs/*.obj'))
+    results = run(filenames,args.repeat)
+
+    if args.output:
+        with open(args.output,'w') as output:
+            json.dump(results,output,indent=2)
+    elif not args.compare:
+        json.dump(results,sys.stdout,indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results,json.load(baseline))
+        if regressions > 0:
+            print('%d regressions.' % regressions)
+            return 1
+    return 0
+
+if __name__ == '__main__': sys.exit(main(len(sys.argv),sys.argv))
@@ -0,0 +1,513 @@
+#
+# bvh.py
+#
+# Defines class bvh, a bounding volume hierarchy over the triangles
+# of a mesh, for finding the first face hit by a ray without having
+# to test every face.
+#
+# The hierarchy is a binary tree of axis-aligned boxes.  Each node's
+# box bounds a run of the triangles, order[start:start+count], and
+# each inner node splits its run between its two children.  The
+# split is chosen by binning the triangles' centers along each axis
+# and minimizing the surface area heuristic (SAH) cost
+#
+#     area(left box) * (left count) + area(right box) * (right count)
+#
+# over the boundaries between bins.  The tree is built a level at a
+# time, with every node of a level split at once using NumPy.
+#
+# Rays can be traced one at a time, with intersect_ray, or a whole
+# array of them at once, with intersect_rays.  The latter takes the
+# rays down the tree together, a chunk of them at a time, carrying
+# an array of (ray, node) pairs from one level to the next, and tests
+# them against the triangles of the leaves they reach with a
+# vectorized Moller-Trumbore test.
+#
+
+from math import sqrt
+from constants import EPSILON
+import numpy as np
+
+BINS = 16       # candidate split planes per axis, plus one
+LEAF_SIZE = 4   # most triangles kept in a leaf
+RAY_CHUNK = 4096   # rays traced together by intersect_rays
+
+class bvh:
+
+    #
+    # bvh(positions,triangles):
+    #
+    # Builds a hierarchy over the triangles given by a t x 3 array of
+    # vertex ids into an n x 3 array of vertex positions.
+    #
+    # Instance attributes:
+    #
+    #   * order: the face ids, arranged so that each node's faces
+    #            are contiguous
+    #   * lo, hi: the corners of each node's box
+    #   * left: the id of each node's first child (its second child
+    #           follows it), or -1 for a leaf
+    #   * start, count: the run of order covered by each node
+    #   * corners: the corner positions of each face in order, as
+    #              a row of 9 coordinates
+    #
+    def __init__(self,positions,triangles):
+        positions = np.asarray(positions,dtype=np.float64)
+        triangles = np.asarray(triangles).reshape(-1,3)
+        corners = positions[triangles]
+        face_lo = corners.min(axis=1)
+        face_hi = corners.max(axis=1)
+        centers = (face_lo + face_hi) * 0.5
+
+        n = len(triangles)
+        size = max(2*n - 1,1)
+        self.lo = np.zeros((size,3))
+        self.hi = np.zeros((size,3))
+        self.left = np.full(size,-1,dtype=np.int64)
+        self.start = np.zeros(size,dtype=np.int64)
+        self.count = np.zeros(size,dtype=np.int64)
+        self.order = np.arange(n)
+
+        if n > 0:
+            self.lo[0] = face_lo.min(axis=0)
+            self.hi[0] = face_hi.max(axis=0)
+        self.count[0] = n
+        nodes = 1
+
+        # The faces of the nodes still to be split, grouped by node,
+        # with their boxes and centers stored coordinate by coordinate.
+        ids = np.arange(n)
+        f_lo = face_lo.T.copy()
+        f_hi = face_hi.T.copy()
+        f_c = centers.T.copy()
+        level = np.array([0]) if n > LEAF_SIZE else np.zeros(0,np.int64)
+
+        # Split each level's nodes all at once.
+        while len(level) > 0:
+            starts = self.start[level]
+            counts = self.count[level]
+            k = len(level)
+            total = len(ids)
+            offsets = np.cumsum(counts) - counts
+            which = np.repeat(np.arange(k),counts)
+
+            # Sort the faces' centers into bins along each axis.
+            cmin = np.minimum.reduceat(f_c,offsets,axis=1)
+            extent = np.maximum.reduceat(f_c,offsets,axis=1) - cmin
+            scale = np.where(extent > 0.0,
+                             BINS / np.where(extent > 0.0, extent, 1.0), 0.0)
+            bins = ((f_c - cmin[:,which]) * scale[:,which]).astype(np.int64)
+            bins = np.clip(bins,0,BINS-1)
+
+            # Score every split between neighboring bins.
+            costs = np.empty((3,k,BINS-1))
+            for axis in range(3):
+                key = which*BINS + bins[axis]
+                n_in = np.bincount(key,minlength=k*BINS).reshape(k,BINS)
+                b_lo = np.full((3,k*BINS),np.inf)
+                b_hi = np.full((3,k*BINS),-np.inf)
+                for j in range(3):
+                    np.minimum.at(b_lo[j],key,f_lo[j])
+                    np.maximum.at(b_hi[j],key,f_hi[j])
+                b_lo = b_lo.reshape(3,k,BINS)
+                b_hi = b_hi.reshape(3,k,BINS)
+
+                l_lo = np.minimum.accumulate(b_lo,axis=2)[:,:,:-1]
+                l_hi = np.maximum.accumulate(b_hi,axis=2)[:,:,:-1]
+                r_lo = np.minimum.accumulate(b_lo[:,:,::-1],axis=2)[:,:,-2::-1]
+                r_hi = np.maximum.accumulate(b_hi[:,:,::-1],axis=2)[:,:,-2::-1]
+                l_n = np.cumsum(n_in,axis=1)[:,:-1]
+                r_n = counts[:,None] - l_n
+                with np.errstate(invalid='ignore',over='ignore'):
+                    cost = area(np.moveaxis(l_lo,0,-1),np.moveaxis(l_hi,0,-1)) * l_n \
+                         + area(np.moveaxis(r_lo,0,-1),
+                                np.moveaxis(r_hi,0,-1)) * r_n
+                costs[axis] = np.where((l_n > 0) & (r_n > 0), cost, np.inf)
+
+            costs = costs.transpose(1,0,2).reshape(k,-1)
+            best = costs.argmin(axis=1)
+            splittable = np.isfinite(costs[np.arange(k),best])
+            best_axis = best // (BINS-1)
+            best_bin = best % (BINS-1)
+
+            # Send each node's faces to the left or right of its run,
+            # keeping their order otherwise.  Nodes whose faces all
+            # fall in one bin are just halved.
+            local = np.arange(total) - offsets[which]
+            right = np.where(splittable[which],
+                             bins[best_axis[which],np.arange(total)]
+                             > best_bin[which],
+                             local >= (counts // 2)[which])
+            n_right = np.bincount(which[right],minlength=k)
+            n_left = counts - n_right
+            lefts = np.cumsum(~right)
+            lefts_before = (lefts[offsets] - ~right[offsets])[which]
+            rank = np.where(right, local - (lefts - lefts_before),
+                            lefts - lefts_before - 1)
+            places = offsets[which] + np.where(right,n_left[which],0) + rank
+            moved = np.empty(total,dtype=np.int64)
+            moved[places] = np.arange(total)
+            ids = ids[moved]
+            f_lo = f_lo[:,moved]
+            f_hi = f_hi[:,moved]
+            f_c = f_c[:,moved]
+
+            # Make the children.
+            children = nodes + 2*np.arange(k)
+            self.left[level] = children
+            kids = np.stack([children,children+1],axis=1).ravel()
+            kid_starts = np.stack([starts,starts+n_left],axis=1).ravel()
+            kid_counts = np.stack([n_left,n_right],axis=1).ravel()
+            kid_offsets = np.stack([offsets,offsets+n_left],axis=1).ravel()
+            self.start[kids] = kid_starts
+            self.count[kids] = kid_counts
+            self.lo[kids] = np.minimum.reduceat(f_lo,kid_offsets,axis=1).T
+            self.hi[kids] = np.maximum.reduceat(f_hi,kid_offsets,axis=1).T
+            nodes += 2*k
+
+            # Settle the faces of the new leaves in the order, and
+            # carry on with the rest.
+            inner = kid_counts > LEAF_SIZE
+            kept = np.repeat(inner,kid_counts)
+            done = ~kept
+            self.order[np.repeat(kid_starts - kid_offsets,kid_counts)[done]
+                       + np.flatnonzero(done)] = ids[done]
+            ids = ids[kept]
+            f_lo = f_lo[:,kept]
+            f_hi = f_hi[:,kept]
+            f_c = f_c[:,kept]
+            level = kids[inner]
+
+        # Pad the boxes a little so that rounding can't lose a hit.
+        pad = EPSILON * max(1.0,float(np.abs(self.hi[0]).max()),
+                            float(np.abs(self.lo[0]).max()))
+        self.lo = self.lo[:nodes] - pad
+        self.hi = self.hi[:nodes] + pad
+        self.left = self.left[:nodes]
+        self.start = self.start[:nodes]
+        self.count = self.count[:nodes]
+        self.corners = corners[self.order].reshape(-1,9)
+
+    #
+    # self.node_count():
+    #
+    # The number of nodes in the hierarchy.
+    #
+    def node_count(self):
+        return len(self.left)
+
+    #
+    # self.intersect_ray(R,d):
+    #
+    # Finds the first face hit by the ray from R in direction d,
+    # both given as triples of coordinates.  Returns [id,[a1,a2,a3],t]
+    # where id is the face's id, a1, a2, a3 are the barycentric
+    # coordinates of the hit point within the face, and t is how
+    # many multiples of d the hit lies from R.  Returns None if the
+    # ray misses.
+    #
+    # Nodes are visited nearest box first, and skipped once their
+    # box lies beyond the best hit found so far.
+    #
+    def intersect_ray(self,R,d):
+        best = None
+        best_t = float('inf')
+        if len(self.order) == 0:
+            return None
+
+        t0 = box_entry(self.lo[0],self.hi[0],R,d,best_t)
+        if t0 is None:
+            return None
+        stack = [(t0,0)]
+        while stack:
+            t0, node = stack.pop()
+            if t0 > best_t:
+                continue
+
+            child = int(self.left[node])
+            if child < 0:
+                # Test the faces of a leaf.
+                start = int(self.start[node])
+                count = int(self.count[node])
+                rows = self.corners[start:start+count].tolist()
+                for i,row in enumerate(rows):
+                    hit = intersect_triangle(row,R,d)
+                    if hit is not None:
+                        id = int(self.order[start+i])
+                        t = hit[1]
+                        if t < best_t or (t == best_t and id < best[0]):
+                            best_t = t
+                            best = [id,hit[0],t]
+                continue
+
+            # Visit the nearer child first.
+            t1 = box_entry(self.lo[child],self.hi[child],R,d,best_t)
+            t2 = box_entry(self.lo[child+1],self.hi[child+1],R,d,best_t)
+            if t1 is not None and t2 is not None:
+                if t1 <= t2:
+                    stack.append((t2,child+1))
+                    stack.append((t1,child))
+                else:
+                    stack.append((t1,child))
+                    stack.append((t2,child+1))
+            elif t1 is not None:
+                stack.append((t1,child))
+            elif t2 is not None:
+                stack.append((t2,child+1))
+
+        return best
+
+    #
+    # self.intersect_rays(origins,directions):
+    #
+    # Finds the first face hit by each of the rays given by an n x 3
+    # array of origins and an n x 3 array of directions.  Returns
+    # the arrays (faces, distances, barycentrics), where for each ray
+    #
+    #   faces: the id of the face hit, or -1 on a miss
+    #   distances: how many multiples of its direction the hit lies
+    #              from its origin, or inf on a miss
+    #   barycentrics: the barycentric coordinates of the hit point
+    #                 within the face, or zeros on a miss
+    #
+    # Rays are traced RAY_CHUNK at a time, which bounds the working
+    # memory.  Ties go to the lower face id.
+    #
+    def intersect_rays(self,origins,directions):
+        origins = np.asarray(origins,dtype=np.float64).reshape(-1,3)
+        directions = np.asarray(directions,dtype=np.float64).reshape(-1,3)
+        n = len(origins)
+        faces = np.full(n,-1,dtype=np.int64)
+        distances = np.full(n,np.inf)
+        barycentrics = np.zeros((n,3))
+        if len(self.order) == 0:
+            return (faces, distances, barycentrics)
+
+        for first in range(0,n,RAY_CHUNK):
+            last = min(first + RAY_CHUNK,n)
+            self.trace(origins[first:last],directions[first:last],
+                       faces[first:last],distances[first:last],
+                       barycentrics[first:last])
+        return (faces, distances, barycentrics)
+
+    #
+    # self.trace(R,d,faces,distances,barycentrics):
+    #
+    # Traces a chunk of rays for intersect_rays, filling in the given
+    # result arrays for them.
+    #
+    def trace(self,R,d,faces,distances,barycentrics):
+        with np.errstate(divide='ignore'):
+            inverse = 1.0 / d
+        rays = np.arange(len(R))
+        nodes = np.zeros(len(R),dtype=np.int64)
+
+        while len(rays) > 0:
+            # Drop the pairs whose ray misses the node's box, or only
+            # reaches it beyond the ray's best hit so far.
+            with np.errstate(invalid='ignore'):
+                ta = (self.lo[nodes] - R[rays]) * inverse[rays]
+                tb = (self.hi[nodes] - R[rays]) * inverse[rays]
+            near = np.fmax(np.fmin(ta,tb).max(axis=1),0.0)
+            far = np.fmin(np.fmax(ta,tb).min(axis=1),distances[rays])
+            reached = near <= far
+            rays = rays[reached]
+            nodes = nodes[reached]
+
+            # Test the rays that reach leaves against their faces.
+            leaf = self.left[nodes] < 0
+            if leaf.any():
+                counts = self.count[nodes[leaf]]
+                pair_rays = np.repeat(rays[leaf],counts)
+                slots = np.repeat(self.start[nodes[leaf]] - np.cumsum(counts)
+                                  + counts,counts) + np.arange(counts.sum())
+                t, a = intersect_triangles(self.corners[slots],
+                                           R[pair_rays],d[pair_rays])
+                hit = np.isfinite(t)
+                self.keep_closest(pair_rays[hit],self.order[slots[hit]],
+                                  t[hit],a[hit],faces,distances,barycentrics)
+
+            # Carry the rest down to both children.
+            inner = ~leaf
+            children = self.left[nodes[inner]]
+            rays = np.repeat(rays[inner],2)
+            nodes = np.stack([children,children+1],axis=1).ravel()
+
+    #
+    # self.keep_closest(rays,ids,t,a,faces,distances,barycentrics):
+    #
+    # Records the hits of face ids at distances t with barycentrics
+    # a along the given rays, wherever they beat the ray's best hit
+    # so far.
+    #
+    def keep_closest(self,rays,ids,t,a,faces,distances,barycentrics):
+        if len(rays) == 0:
+            return
+        # Find each ray's closest new hit, the lowest face id on ties.
+        order = np.lexsort((ids,t,rays))
+        rays = rays[order]
+        first = np.ones(len(rays),dtype=bool)
+        first[1:] = rays[1:] != rays[:-1]
+        rays = rays[first]
+        ids = ids[order][first]
+        t = t[order][first]
+        a = a[order][first]
+
+        better = (t < distances[rays]) \
+                 | ((t == distances[rays]) & (ids < faces[rays]))
+        rays = rays[better]
+        faces[rays] = ids[better]
+        distances[rays] = t[better]
+        barycentrics[rays] = a[better]
+
+
+#
+# area(lo,hi):
+#
+# The surface areas of the boxes with the given corners.
+#
+def area(lo,hi):
+    size = hi - lo
+    dx = size[...,0]
+    dy = size[...,1]
+    dz = size[...,2]
+    return 2.0 * (dx*dy + dy*dz + dz*dx)
+
+#
+# box_entry(lo,hi,R,d,limit):
+#
+# Where the ray from R in direction d enters the box with corners
+# lo and hi, as a multiple of d (clamped to be no less than 0).
+# Returns None if the ray misses the box, or only reaches it
+# beyond the given limit.
+#
+def box_entry(lo,hi,R,d,limit):
+    near = 0.0
+    far = limit
+    for lo_i,hi_i,r,d_i in zip(lo.tolist(),hi.tolist(),R,d):
+        if d_i == 0.0:
+            if r < lo_i or r > hi_i:
+                return None
+        else:
+            ta = (lo_i - r) / d_i
+            tb = (hi_i - r) / d_i
+            if ta > tb:
+                ta, tb = tb, ta
+            if ta > near:
+                near = ta
+            if tb < far:
+                far = tb
+            if near > far:
+                return None
+    return near
+
+#
+# intersect_triangle(corners,R,d):
+#
+# The same test as face.intersect_ray, for the triangle with the
+# given 9 corner coordinates and the ray from R in direction d,
+# all as plain floats.  Returns [[a1,a2,a3],t,dist] or None.
+#
+def intersect_triangle(corners,R,d):
+    q1x,q1y,q1z,q2x,q2y,q2z,q3x,q3y,q3z = corners
+    rx,ry,rz = R
+    dx,dy,dz = d
+
+    # compute normals to the plane of the facet
+    v2x = q2x - q1x; v2y = q2y - q1y; v2z = q2z - q1z
+    v3x = q3x - q1x; v3y = q3y - q1y; v3z = q3z - q1z
+    ox = v2y*v3z - v2z*v3y
+    oy = v2z*v3x - v2x*v3z
+    oz = v2x*v3y - v2y*v3x
+    o_norm = sqrt(ox*ox + oy*oy + oz*oz)
+    if o_norm < EPSILON:
+        # the facet is a sliver or a point
+        return None
+
+    lx, ly, lz = unit(v2x,v2y,v2z)
+    mx, my, mz = unit(v3x,v3y,v3z)
+    nx, ny, nz = unit(ly*mz - lz*my, lz*mx - lx*mz, lx*my - ly*mx)
+    dist = nx*(rx-q1x) + ny*(ry-q1y) + nz*(rz-q1z)
+    if abs(dist) < EPSILON:
+        # the ray source R is in the plane of this facet
+        return None
+
+    # flip the orientation of the surface normal to the back face
+    if dist < 0:
+        nx = -nx; ny = -ny; nz = -nz
+    ratio = -(nx*dx + ny*dy + nz*dz)
+    if ratio <= 0:
+        # the ray shoots along or away from the facet's plane
+        return None
+
+    # compute where the ray intersects the plane
+    t = abs(dist) / ratio
+    wx = (rx + t*dx) - q1x
+    wy = (ry + t*dy) - q1y
+    wz = (rz + t*dz) - q1z
+
+    # check if P lives within the facet
+    o3x = v2y*wz - v2z*wy; o3y = v2z*wx - v2x*wz; o3z = v2x*wy - v2y*wx
+    o2x = wy*v3z - wz*v3y; o2y = wz*v3x - wx*v3z; o2z = wx*v3y - wy*v3x
+    if o2x*ox + o2y*oy + o2z*oz < 0 or o3x*ox + o3y*oy + o3z*oz < 0:
+        # the point P is not in the cone <Q1,v2,v3>
+        return None
+
+    a2 = sqrt(o2x*o2x + o2y*o2y + o2z*o2z) / o_norm
+    a3 = sqrt(o3x*o3x + o3y*o3y + o3z*o3z) / o_norm
+    a1 = 1.0-a2-a3
+    if a1 < 0.0 or a2 < 0.0 or a3 < 0.0:
+        # the point P is beyond line <Q2,Q3> in that cone
+        return None
+
+    return [[a1,a2,a3],t,dist]
+
+#
+# unit(x,y,z):
+#
+# The components of the unit vector in the direction of (x,y,z),
+# as computed by vector.unit.
+#
+def unit(x,y,z):
+    n = sqrt(x*x + y*y + z*z)
+    if n < EPSILON:
+        return (1.0,0.0,0.0)
+    s = 1.0/n
+    return (s*x,s*y,s*z)
+
+#
+# intersect_triangles(corners,R,d):
+#
+# The Moller-Trumbore ray/triangle test, run on arrays: an m x 9
+# array of triangle corners, and m x 3 arrays of ray origins and
+# directions.  Returns the arrays (t, a), where t gives how many
+# multiples of its direction each ray travels to its triangle (inf
+# on a miss), and the rows of a are the barycentric coordinates of
+# the hit points.
+#
+# As with face.intersect_ray, both sides of a triangle count, and
+# slivers are skipped, as are rays from points in a triangle's plane.
+#
+def intersect_triangles(corners,R,d):
+    q1 = corners[:,0:3]
+    e1 = corners[:,3:6] - q1
+    e2 = corners[:,6:9] - q1
+    normal = np.cross(e1,e2)
+    p = np.cross(d,e2)
+    det = (e1 * p).sum(axis=1)
+    s = R - q1
+    q = np.cross(s,e1)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        inverse = 1.0 / det
+        u = (s * p).sum(axis=1) * inverse
+        v = (d * q).sum(axis=1) * inverse
+        t = (e2 * q).sum(axis=1) * inverse
+        hit = (det != 0.0) & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) \
+              & (t > 0.0) \
+              & ((normal * normal).sum(axis=1) >= EPSILON * EPSILON) \
+              & (np.abs((normal * s).sum(axis=1))
+                 >= EPSILON * np.sqrt((normal * normal).sum(axis=1)))
+        a = np.stack([1.0 - u - v, u, v],axis=1)
+    t = np.where(hit,t,np.inf)
+    a[~hit] = 0.0
+    return (t, a)
@@ -0,0 +1,169 @@
+#
+# framestats.py
+#
+# Defines class framestats, which keeps rolling statistics of the
+# cost of interacting with a scene in object-view.py.  The viewer
+# records, as they happen,
+#
+#   * the time taken by each call of draw(), and the time between
+#     the starts of successive frames, which gives the frame rate
+#   * the time taken by each call of motion()
+#   * the time taken by each pick, i.e. each scene.intersect_ray
+#   * the bytes uploaded into GL buffers, added up for each frame
+#
+# The statistics are taken over a window of the latest samples of
+# each.  Each frame is also kept as a row, for saving as CSV, though
+# only the latest ROWS rows are kept, so that a viewer left running
+# doesn't keep growing.
+#
+
+import collections
+import csv
+import sys
+
+# The columns of a frame's row.
+COLUMNS = ['frame', 'time', 'draw_ms', 'interval_ms', 'motion_events',
+           'motion_ms', 'picks', 'pick_ms', 'upload_bytes']
+
+# The most rows kept, ten minutes' worth at 60 frames per second.
+ROWS = 36000
+
+class framestats:
+
+    #
+    # framestats(window=120,rows=ROWS):
+    #
+    # Starts the statistics, kept over the given number of latest
+    # samples, keeping at most the given number of rows.
+    #
+    # Instance attributes:
+    #
+    #   * samples: for each of 'draw', 'interval', 'motion', 'pick',
+    #              and 'upload', a queue of its latest samples
+    #   * rows: a queue of a row of values for each of the latest
+    #           frames, in the order of COLUMNS
+    #   * frames: the number of frames so far
+    #
+    def __init__(self,window=120,rows=ROWS):
+        self.window = window
+        self.samples = {name: collections.deque(maxlen=window)
+                        for name in ['draw','interval','motion','pick',
+                                     'upload']}
+        self.rows = collections.deque(maxlen=rows)
+        self.frames = 0
+        self.last_start = None
+        self.start_frame()
+
+    #
+    # self.start_frame():
+    #
+    # Starts gathering the motion, pick, and upload costs of the
+    # next frame.
+    #
+    def start_frame(self):
+        self.motion_events = 0
+        self.motion_time = 0.0
+        self.picks = 0
+        self.pick_time = 0.0
+        self.upload_bytes = 0
+
+    #
+    # self.motion(seconds), self.pick(seconds), self.upload(nbytes):
+    #
+    # Record a call of motion(), a pick, and a buffer upload.
+    #
+    def motion(self,seconds):
+        self.samples['motion'].append(seconds)
+        self.motion_events += 1
+        self.motion_time += seconds
+
+    def pick(self,seconds):
+        self.samples['pick'].append(seconds)
+        self.picks += 1
+        self.pick_time += seconds
+
+    def upload(self,nbytes):
+        self.upload_bytes += nbytes
+
+    #
+    # self.frame(start,seconds):
+    #
+    # Records a frame whose draw() started at the given time (from
+    # time.perf_counter) and took the given number of seconds.
+    #
+    def frame(self,start,seconds):
+        interval = None
+        if self.last_start is not None:
+            interval = start - self.last_start
+            self.samples['interval'].append(interval)
+        self.last_start = start
+        self.samples['draw'].append(seconds)
+        self.samples['upload'].append(self.upload_bytes)
+
+        self.rows.append([self.frames, start, 1000.0*seconds,
+                          None if interval is None else 1000.0*interval,
+                          self.motion_events, 1000.0*self.motion_time,
+                          self.picks, 1000.0*self.pick_time,
+                          self.upload_bytes])
+        self.frames += 1
+        self.start_frame()
+
+    #
+    # self.mean(name), self.worst(name):
+    #
+    # The mean and the greatest of the latest samples of the given
+    # kind, or 0 if there are none.
+    #
+    def mean(self,name):
+        samples = self.samples[name]
+        return sum(samples) / len(samples) if samples else 0.0
+
+    def worst(self,name):
+        return max(self.samples[name],default=0.0)
+
+    #
+    # self.fps():
+    #
+    # The frames per second over the latest frames.
+    #
+    def fps(self):
+        interval = self.mean('interval')
+        return 1.0/interval if interval > 0.0 else 0.0
+
+    #
+    # self.lines():
+    #
+    # The latest statistics, as lines of text.
+    #
+    def lines(self):
+        return ['%.1f fps' % self.fps(),
+                'draw   %6.2f ms (worst %.2f)' %
+                (1000.0*self.mean('draw'), 1000.0*self.worst('draw')),
+                'motion %6.3f ms (worst %.3f)' %
+                (1000.0*self.mean('motion'), 1000.0*self.worst('motion')),
+                'pick   %6.2f ms (worst %.2f)' %
+                (1000.0*self.mean('pick'), 1000.0*self.worst('pick')),
+                'upload %6.0f bytes/frame' % self.mean('upload')]
+
+    #
+    # self.report(file=None):
+    #
+    # Prints the latest statistics on one line, to the given file or
+    # to standard output.
+    #
+    def report(self,file=None):
+        if file is None:
+            file = sys.stdout
+        print(' | '.join(self.lines()),file=file)
+
+    #
+    # self.save_csv(filename):
+    #
+    # Writes a row for each of the latest frames (see ROWS) to the
+    # given CSV file.
+    #
+    def save_csv(self,filename):
+        with open(filename,'w',newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(COLUMNS)
+            writer.writerows(self.rows)
@@ -20,13 +20,15 @@
 from random import random
 from math import sqrt, pi, sin, cos, acos
 from constants import EPSILON
-from OpenGL.GL import *
 
 #
 # Description of 3-D point objects and their methods.
 #
 class point:
 
+    # (no per-instance dictionary, just the three coordinates)
+    __slots__ = ('x','y','z')
+
     def __init__(self,_x,_y,_z):
         """ Construct a new point instance from its coordinates. """
         self.x = _x
@@ -44,7 +46,9 @@ class point:
 
     def glVertex3(self):
         """ Issues a glVertex3f call with the coordinates of self. """
-        glVertex3f(self[0],self[1],self[2])
+        # (imported here so that points can be used without OpenGL)
+        from OpenGL.GL import glVertex3f
+        glVertex3f(self.x,self.y,self.z)
 
     def plus(self,offset):
         """ Computes a point-vector sum, yielding a new point. """
@@ -99,6 +103,12 @@ class point:
 
     def __getitem__(self,i):
         """ Defines p[i] """
+        if i == 0:
+            return self.x
+        if i == 1:
+            return self.y
+        if i == 2:
+            return self.z
         return (self.components())[i]
 
 
@@ -107,6 +117,9 @@ class point:
 #
 class vector:
 
+    # (no per-instance dictionary, just the three components)
+    __slots__ = ('dx','dy','dz')
+
     def __init__(self,_dx,_dy,_dz):
         """ Construct a new vector instance. """
         self.dx = _dx
@@ -210,6 +223,12 @@ class vector:
 
     def __getitem__(self,i):
         """ Defines v[i] """
+        if i == 0:
+            return self.dx
+        if i == 1:
+            return self.dy
+        if i == 2:
+            return self.dz
         return (self.components())[i]
 
 # 
@@ -0,0 +1,296 @@
+#
+# instrument.py
+#
+# Optional timers and counters for the stages of loading and
+# compiling a scene.  The code in scene.py marks out its stages
+#
+#   with instrument.stage('parse'):
+#       ...
+#
+# and counts the work it does
+#
+#   instrument.count('edges registered',n)
+#
+# Both do nothing until instrumentation is turned on with enable().
+# Then each stage records how many times it ran and the wall time it
+# took, and each counter adds up what it's given.  Stages run within
+# other stages are recorded under dotted names, like 'read.parse'.
+#
+# Two more costly measurements can also be turned on:
+#
+#   * tracing, where each stage also records the number of memory
+#     blocks it left allocated and its peak memory use, by way of
+#     tracemalloc
+#
+#   * profiling, where each stage is run under cProfile, and its
+#     profile is written to a .prof file named for the stage within
+#     a given directory, for reading with pstats.  A stage's profile
+#     leaves out the stages run within it, which get their own.
+#
+# Stages can be run in several threads at once, with their totals
+# added together.  Tracing and profiling, though, are only meant for
+# one thread at a time.
+#
+# The results can be had with results(), and printed with report().
+#
+
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Whether the stages and counters record anything.
+enabled = False
+
+# Whether stages measure their memory with tracemalloc, and the
+# directory stages write their profiles to, if any.
+tracing = False
+profiles = None
+
+# Whether tracemalloc was started by enable(), rather than already
+# running, and so is to be stopped by disable().
+started_tracing = False
+
+# What's been recorded: for each stage, a dictionary of its totals,
+# and for each counter, its total.  These are shared by all threads,
+# and guarded by the lock.
+stages = { }
+counters = { }
+lock = threading.Lock()
+
+# What each thread keeps for itself: the stack of the stages it's
+# running, innermost last, and the time it's spent on tracing and
+# profiling, which is left out of the stages' times.
+threads = threading.local()
+
+#
+# class nothing
+#
+# What instrument.stage gives back while instrumentation is off: a
+# context that does nothing.
+#
+class nothing:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,kind,value,traceback):
+        return False
+
+NOTHING = nothing()
+
+#
+# class timed
+#
+# The context that records a run of a stage.
+#
+class timed:
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        begin = time.perf_counter()
+        stack = running()
+        parent = stack[-1] if stack else None
+        self.path = parent.path + '.' + self.name if parent else self.name
+        stack.append(self)
+        with lock:
+            if self.path not in stages:
+                stages[self.path] = {'calls': 0, 'seconds': 0.0}
+
+        if tracing:
+            # Note the peak so far for the enclosing stage, since its
+            # peak is about to be reset for this one.
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent.peak = max(parent.peak,peak)
+            tracemalloc.reset_peak()
+            self.memory = current
+            self.peak = current
+            self.blocks = blocks()
+
+        self.profile = None
+        if profiles is not None:
+            if parent is not None and parent.profile is not None:
+                parent.profile.disable()
+            self.profile = profiler(self.path)
+            self.profile.enable()
+
+        self.start = time.perf_counter()
+        threads.overhead += self.start - begin
+        self.overhead = threads.overhead
+        return self
+
+    def __exit__(self,kind,value,traceback):
+        end = time.perf_counter()
+        elapsed = end - self.start - (threads.overhead - self.overhead)
+        stack = running()
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(os.path.join(profiles,self.path+'.prof'))
+            if parent is not None and parent.profile is not None:
+                parent.profile.enable()
+
+        if tracing:
+            self.peak = max(self.peak,tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent.peak = max(parent.peak,self.peak)
+            self.blocks = blocks() - self.blocks
+
+        with lock:
+            totals = stages[self.path]
+            totals['calls'] += 1
+            totals['seconds'] += elapsed
+            if tracing:
+                totals['blocks'] = totals.get('blocks',0) + self.blocks
+                totals['peak_bytes'] = max(totals.get('peak_bytes',0),
+                                           self.peak - self.memory)
+        threads.overhead += time.perf_counter() - end
+        return False
+
+#
+# running():
+#
+# The stack of stages the current thread is running.
+#
+def running():
+    if not hasattr(threads,'stack'):
+        threads.stack = []
+        threads.overhead = 0.0
+    return threads.stack
+
+# The cProfile profilers of the stages, by their dotted names.  Each
+# gathers up all the runs of its stage.
+profilers = { }
+
+#
+# profiler(path):
+#
+# The profiler for the stage with the given dotted name.
+#
+def profiler(path):
+    if path not in profilers:
+        profilers[path] = cProfile.Profile()
+    return profilers[path]
+
+#
+# blocks():
+#
+# The number of memory blocks tracemalloc has traced as allocated.
+#
+def blocks():
+    snapshot = tracemalloc.take_snapshot()
+    return sum(stat.count for stat in snapshot.statistics('filename'))
+
+#
+# stage(name):
+#
+# A context for running the stage with the given name, which records
+# the run if instrumentation is on.
+#
+def stage(name):
+    if not enabled:
+        return NOTHING
+    return timed(name)
+
+#
+# count(name,amount=1):
+#
+# Adds the given amount to the counter with the given name, if
+# instrumentation is on.
+#
+def count(name,amount=1):
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name,0) + amount
+
+#
+# enable(trace=False,profile_dir=None):
+#
+# Turns on instrumentation, and with it tracing and profiling if
+# asked for.  Profiles are written into profile_dir, which is made
+# if need be.  Tracing started by someone else is left to them.
+#
+def enable(trace=False,profile_dir=None):
+    global enabled, tracing, profiles, started_tracing
+    enabled = True
+    tracing = trace
+    if tracing and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracing = True
+    profiles = profile_dir
+    if profiles is not None:
+        os.makedirs(profiles,exist_ok=True)
+
+#
+# disable():
+#
+# Turns off instrumentation, keeping what's been recorded.  Stops
+# tracemalloc only if enable() started it.
+#
+def disable():
+    global enabled, tracing, profiles, started_tracing
+    if started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    started_tracing = False
+    enabled = False
+    tracing = False
+    profiles = None
+
+#
+# reset():
+#
+# Forgets everything recorded so far.
+#
+def reset():
+    with lock:
+        stages.clear()
+        counters.clear()
+        profilers.clear()
+
+#
+# results():
+#
+# A copy of what's been recorded, as a dictionary with the entries
+#
+#   'stages': for each stage's dotted name, a dictionary giving its
+#             'calls' and total 'seconds', and, if traced, the
+#             'blocks' it left allocated and its 'peak_bytes'
+#   'counters': each counter's total
+#
+def results():
+    with lock:
+        return {'stages': {path: dict(totals)
+                           for path,totals in stages.items()},
+                'counters': dict(counters)}
+
+#
+# report(file=None):
+#
+# Prints a summary of what's been recorded, to the given file or to
+# standard output.
+#
+def report(file=None):
+    if file is None:
+        file = sys.stdout
+    recorded = results()
+    if not recorded['stages'] and not recorded['counters']:
+        print('No stages recorded.',file=file)
+        return
+    if recorded['stages']:
+        print('%-28s %6s %10s %10s %12s' %
+              ('stage','calls','seconds','blocks','peak bytes'),file=file)
+        for path,totals in recorded['stages'].items():
+            name = '  ' * path.count('.') + path.rsplit('.',1)[-1]
+            print('%-28s %6d %10.4f %10s %12s' %
+                  (name, totals['calls'], totals['seconds'],
+                   totals.get('blocks','-'), totals.get('peak_bytes','-')),
+                  file=file)
+    for name,total in recorded['counters'].items():
+        print('%-28s %d' % (name,total),file=file)
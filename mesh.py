@@ -0,0 +1,797 @@
+#
+# mesh.py
+#
+# Defines class mesh, a compact "struct of arrays" representation of
+# a twinned half-edge surface.  Rather than keeping an object for
+# every vertex, edge, and face, a mesh keeps a handful of NumPy arrays,
+# each indexed by vertex id or by half-edge id:
+#
+#   positions: an n x 3 float64 array of vertex locations
+#   normals: an n x 3 float64 array of vertex normals, left as zero
+#            until they are computed
+#   out: for each vertex, the id of one of its out edges, or -1
+#
+#   source: for each half-edge, the id of the vertex it leaves
+#   next: for each half-edge, the next half-edge around its face
+#   twin: for each half-edge, its opposite twin, or -1
+#   face: for each half-edge, the id of the face to its left
+#
+#   face_normals: a t x 3 float64 array of face normals, left as
+#                 zero until they are computed
+#
+# So that vertices and faces can be added a few at a time, each of
+# these arrays is kept in a buffer with room to spare, which doubles
+# whenever it fills up, and the arrays themselves are views of the
+# filled parts of their buffers.  (Assigning to one of the arrays
+# replaces its buffer.)
+#
+# The twins of new half-edges are found by link_twins, all at once,
+# or, for the few of a face or so, one at a time through the mesh's
+# key index (see below).  It also notes any trouble it finds
+# (though not for half-edges restored from a cache, whose twins are
+# already known):
+#
+#   bad_orientations: the id of the face of each half-edge running
+#                     the same way as an earlier one, i.e. of a face
+#                     that's oriented opposite to a neighbor
+#   non_manifold: the ids of half-edges along edges shared by more
+#                 than two half-edges
+#
+# For those few at a time, the mesh keeps an index of its half-edges
+# by edge key (see edge_keys): sorted_keys, the keys of the first
+# indexed half-edges in order, with sorted_edges, their ids, and
+# recent, a dictionary from the key of each half-edge linked since
+# to a list of their ids.  The first filed half-edges are in the
+# index, and recent is merged into the sorted arrays once it grows
+# large.
+#
+# It also keeps its edge map, a dictionary from each (source, target)
+# pair of vertex ids to the id of the half-edge between them, for
+# edge.between_ids in scene.py.  The first mapped half-edges are in
+# the map; those after are entered only when they're needed.
+#
+# When files are welded as they're read (see scene.read), the mesh
+# counts the vertices merged away, as welded.
+#
+# Normals can be computed for all the faces and vertices at once with
+# compute_face_normals and compute_normals.
+#
+# A mesh also counts the changes made to its vertex positions, so
+# that structures built from them, like the bounding volume
+# hierarchy used for ray picking, know when to be rebuilt.  Code that
+# writes into the positions array directly should call moved().
+# Likewise it counts the changes made to how it's connected, for its
+# adjacency indexes (see adjacency.py), and code that writes into
+# the out, source, next, or twin arrays should call relinked().
+#
+# The three half-edges bordering face f have ids 3f, 3f+1, and 3f+2,
+# running counterclockwise around it, starting from its first corner.
+#
+# The vertex, edge, and face classes in scene.py are thin views onto
+# a mesh, each holding just an id.  A mesh shares nothing with other
+# meshes, so each can be loaded, used, and freed on its own.
+#
+
+import numpy as np
+import adjacency
+import bvh
+from constants import EPSILON
+
+# The most new half-edges that link_twins links one at a time,
+# rather than by sorting all the keys.
+FEW_EDGES = 64
+
+# The fewest half-edges kept in the recent part of a mesh's key index
+# before it's merged into the sorted part.
+RECENT_EDGES = 4096
+
+#
+# edge_keys(sources,targets):
+#
+# The key of the edge of each half-edge with the given source and
+# target vertex ids: the two ids, smaller first, as the high and low
+# halves of one int64.
+#
+def edge_keys(sources,targets):
+    sources = np.asarray(sources,dtype=np.int64)
+    targets = np.asarray(targets,dtype=np.int64)
+    return (np.minimum(sources,targets) << 32) | np.maximum(sources,targets)
+
+#
+# filled(name,kind):
+#
+# A property giving the filled part of the mesh's buffer with the
+# given name, which has a row for each vertex, edge, or face, as
+# given by kind.
+#
+def filled(name,kind):
+    total = kind + '_total'
+
+    def get(self):
+        return self.buffers[name][:getattr(self,total)]
+
+    def put(self,array):
+        self.buffers[name] = array
+
+    return property(get,put)
+
+class mesh:
+
+    positions = filled('positions','vertex')
+    normals = filled('normals','vertex')
+    out = filled('out','vertex')
+    source = filled('source','edge')
+    next = filled('next','edge')
+    twin = filled('twin','edge')
+    face = filled('face','edge')
+    face_normals = filled('face_normals','face')
+
+    #
+    # mesh():
+    #
+    # Makes an empty mesh.
+    #
+    # Instance attributes, besides those described above:
+    #
+    #   * buffers: the buffer of each array, by name
+    #   * vertex_total, edge_total, face_total: the number of vertices,
+    #     half-edges, and faces, i.e. the filled rows of the buffers
+    #
+    def __init__(self):
+        self.buffers = {'positions': np.zeros((0,3)),
+                        'normals': np.zeros((0,3)),
+                        'out': np.zeros(0,dtype=np.int32),
+                        'source': np.zeros(0,dtype=np.int32),
+                        'next': np.zeros(0,dtype=np.int32),
+                        'twin': np.zeros(0,dtype=np.int32),
+                        'face': np.zeros(0,dtype=np.int32),
+                        'face_normals': np.zeros((0,3))}
+        self.vertex_total = 0
+        self.edge_total = 0
+        self.face_total = 0
+        self.bad_orientations = np.zeros(0,dtype=np.int64)
+        self.non_manifold = np.zeros(0,dtype=np.int64)
+        self.edge_map = { }
+        self.mapped = 0
+        self.sorted_keys = np.zeros(0,dtype=np.int64)
+        self.sorted_edges = np.zeros(0,dtype=np.int64)
+        self.recent = { }
+        self.indexed = 0
+        self.filed = 0
+        self.welded = 0
+        self.changes = 0
+        self.hierarchy = None
+        self.links = 0
+        self.indexes = None
+
+    #
+    # self.vertex_count(), self.edge_count(), self.face_count():
+    #
+    # The number of vertices, half-edges, and faces in the mesh.
+    #
+    def vertex_count(self):
+        return self.vertex_total
+
+    def edge_count(self):
+        return self.edge_total
+
+    def face_count(self):
+        return self.face_total
+
+    #
+    # self.append(name,count,rows):
+    #
+    # Writes the given rows into the named buffer after its first
+    # count rows, doubling the buffer first if they don't fit.
+    #
+    def append(self,name,count,rows):
+        buffer = self.buffers[name]
+        needed = count + len(rows)
+        if len(buffer) < needed:
+            bigger = np.empty((max(needed,2*len(buffer)),) + buffer.shape[1:],
+                              dtype=buffer.dtype)
+            bigger[:count] = buffer[:count]
+            self.buffers[name] = buffer = bigger
+        buffer[count:needed] = rows
+
+    #
+    # self.triangles():
+    #
+    # A t x 3 array of the corner vertex ids of each face.
+    #
+    def triangles(self):
+        return self.source.reshape(-1,3)
+
+    #
+    # self.nbytes():
+    #
+    # The number of bytes taken up by the mesh's arrays.
+    #
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.positions, self.normals,
+                                      self.out, self.source, self.next,
+                                      self.twin, self.face,
+                                      self.face_normals])
+
+    #
+    # self.moved():
+    #
+    # Notes that vertex positions have changed.
+    #
+    def moved(self):
+        self.changes += 1
+
+    #
+    # self.relinked():
+    #
+    # Notes that the mesh's connectivity has changed.
+    #
+    def relinked(self):
+        self.links += 1
+
+    #
+    # self.bvh():
+    #
+    # A bounding volume hierarchy over the faces, built the first
+    # time it's asked for, and again after any change.
+    #
+    def bvh(self):
+        if self.hierarchy is None or self.hierarchy[0] != self.changes:
+            self.hierarchy = (self.changes,
+                              bvh.bvh(self.positions,self.triangles()))
+        return self.hierarchy[1]
+
+    #
+    # self.adjacency():
+    #
+    # The adjacency indexes of the mesh, built the first time they're
+    # asked for, and again after any change to its connectivity.
+    #
+    def adjacency(self):
+        if self.indexes is None or self.indexes[0] != self.links:
+            self.indexes = (self.links, adjacency.adjacency(self))
+        return self.indexes[1]
+
+    #
+    # self.add_vertices(positions,normals):
+    #
+    # Appends vertices at the given n x 3 array of positions, with
+    # the given normals if any.  Returns the id of the first one.
+    #
+    def add_vertices(self,positions,normals=None):
+        first = self.vertex_count()
+        positions = np.asarray(positions,dtype=np.float64).reshape(-1,3)
+        if normals is None:
+            normals = np.zeros_like(positions)
+        self.append('positions',first,positions)
+        self.append('normals',first,normals)
+        self.append('out',first,np.full(len(positions),-1,np.int32))
+        self.vertex_total = first + len(positions)
+        self.moved()
+        self.relinked()
+        return first
+
+    #
+    # self.add_triangles(triangles):
+    #
+    # Appends a face for each row of the given t x 3 array of vertex
+    # ids, along with its three half-edges.  The new half-edges are
+    # left without twins.  Returns the id of the first new half-edge.
+    #
+    # Each vertex's out edge becomes the last new half-edge to leave
+    # it, just as if the faces were added one at a time.
+    #
+    def add_triangles(self,triangles):
+        first = self.edge_count()
+        sources = np.asarray(triangles,dtype=np.int32).reshape(-1)
+        ids = np.arange(first,first+len(sources),dtype=np.int32)
+        nexts = ids + 1
+        nexts[2::3] -= 3
+
+        self.append('source',first,sources)
+        self.append('next',first,nexts)
+        self.append('twin',first,np.full(len(sources),-1,np.int32))
+        self.append('face',first,ids // 3)
+        self.append('face_normals',first // 3,np.zeros((len(sources)//3,3)))
+        self.edge_total = first + len(sources)
+        self.face_total = self.edge_total // 3
+        np.maximum.at(self.out,sources,ids)
+        self.moved()
+        self.relinked()
+        return first
+
+    #
+    # self.link_twins(first):
+    #
+    # Links each half-edge, from the one with id first on, to its
+    # twin.  Gives just the twins that registering the half-edges one
+    # at a time in an edge map would give: each takes as its twin the
+    # latest half-edge before it running the other way between its
+    # two vertices, and becomes that one's twin in turn.
+    #
+    # A few new half-edges, like those of a face.add, are linked by
+    # link_few.  Otherwise, rather than keep a map, each half-edge's
+    # vertex pair, smaller id first, is encoded as one int64 key.
+    # Sorting the keys brings the half-edges along each edge together
+    # into a run, in id order, and within each run the latest
+    # half-edge before each one going either way is found with a
+    # running maximum.
+    #
+    # Gives back the arrays (bad, non_manifold) of what was found
+    # amongst the new half-edges (see above), and adds them to the
+    # mesh's bad_orientations and non_manifold.
+    #
+    def link_twins(self,first=0):
+        count = self.edge_count()
+        if first >= count:
+            bad = non_manifold = np.zeros(0,dtype=np.int64)
+        elif count - first <= FEW_EDGES:
+            bad, non_manifold = self.link_few(first)
+        else:
+            bad, non_manifold = self.link_many(first)
+        self.relinked()
+        if len(bad) > 0:
+            self.bad_orientations = np.concatenate([self.bad_orientations,
+                                                    bad])
+        if len(non_manifold) > 0:
+            self.non_manifold = np.concatenate([self.non_manifold,
+                                                non_manifold])
+        return (bad, non_manifold)
+
+    #
+    # self.link_few(first):
+    #
+    # Links the half-edges from the one with id first on, for
+    # link_twins, one at a time.  The earlier half-edges along each
+    # new one's edge are looked up in the key index, and the new ones
+    # are then filed in it.
+    #
+    def link_few(self,first):
+        count = self.edge_count()
+        self.index_edges(first)
+        keys = self.keys(first,count)
+        lows = np.searchsorted(self.sorted_keys,keys,'left').tolist()
+        highs = np.searchsorted(self.sorted_keys,keys,'right').tolist()
+        keys = keys.tolist()
+        sources = self.source[first:count].tolist()
+        targets = self.source[self.next[first:count]].tolist()
+
+        # Gather the half-edges along each new one's edge, in order.
+        runs = { }
+        for e,key,low,high in zip(range(first,count),keys,lows,highs):
+            if key not in runs:
+                runs[key] = self.sorted_edges[low:high].tolist() \
+                            + self.recent.get(key,[])
+            runs[key].append(e)
+
+        twins = { }
+        bad = []
+        non_manifold = []
+        for e,key,a,b in zip(range(first,count),keys,sources,targets):
+            run = runs[key]
+            if len(run) > 2:
+                non_manifold.append(e)
+
+            # Find the latest earlier half-edge going each way.
+            same = other = -1
+            for x in reversed(run):
+                if x >= e:
+                    continue
+                way = sources[x-first] if x >= first else int(self.source[x])
+                if way == a:
+                    same = x if same < 0 else same
+                else:
+                    other = x if other < 0 else other
+                if same >= 0 and other >= 0:
+                    break
+            if same >= 0:
+                bad.append(e // 3)
+
+            # (a half-edge from a vertex to itself is its own twin)
+            twin = e if a == b else other
+            twins[e] = twin
+            if twin >= 0:
+                twins[twin] = e
+
+        self.twin[list(twins.keys())] = list(twins.values())
+        self.file_recent(first,keys)
+        return (np.array(bad,dtype=np.int64),
+                np.array(non_manifold,dtype=np.int64))
+
+    #
+    # self.keys(first,last):
+    #
+    # The edge keys of the half-edges with ids from first up to last.
+    #
+    def keys(self,first,last):
+        return edge_keys(self.source[first:last],
+                         self.source[self.next[first:last]])
+
+    #
+    # self.index_edges(first):
+    #
+    # Brings the key index up to just the half-edges before the one
+    # with id first, filing the few since the last filed in recent,
+    # or else merging them all into the sorted arrays.  Merging also
+    # happens whenever recent grows past RECENT_EDGES, or a 64th of
+    # the sorted arrays, so that its cost is spread thinly over the
+    # half-edges filed.
+    #
+    def index_edges(self,first):
+        if self.filed < first <= self.filed + FEW_EDGES:
+            self.file_recent(self.filed,self.keys(self.filed,first).tolist())
+        if self.filed != first or \
+           first - self.indexed > max(RECENT_EDGES,self.indexed // 64):
+            self.merge_index(first)
+
+    #
+    # self.file_recent(first,keys):
+    #
+    # Files the half-edges with the given keys, from the one with id
+    # first on, in recent.
+    #
+    def file_recent(self,first,keys):
+        for e,key in enumerate(keys,first):
+            self.recent.setdefault(key,[]).append(e)
+        self.filed = first + len(keys)
+
+    #
+    # self.merge_index(last):
+    #
+    # Indexes just the half-edges before the one with id last, all in
+    # the sorted arrays.
+    #
+    def merge_index(self,last):
+        if self.indexed > last:
+            self.sorted_keys = self.sorted_keys[:0]
+            self.sorted_edges = self.sorted_edges[:0]
+            self.indexed = 0
+        keys = np.concatenate([self.sorted_keys,
+                               self.keys(self.indexed,last)])
+        edges = np.concatenate([self.sorted_edges,
+                                np.arange(self.indexed,last)])
+        order = np.argsort(keys,kind='stable')
+        self.sorted_keys = keys[order]
+        self.sorted_edges = edges[order]
+        self.indexed = self.filed = last
+        self.recent.clear()
+
+    #
+    # self.link_many(first):
+    #
+    # Links the half-edges from the one with id first on, for
+    # link_twins, all at once by sorting their keys.  When that's
+    # all of the mesh's half-edges, the sorted keys are kept as its
+    # key index.
+    #
+    def link_many(self,first):
+        count = self.edge_count()
+        sources = self.source.astype(np.int64)
+        targets = sources[self.next]
+        keys = edge_keys(sources,targets)
+
+        # Only the earlier half-edges along the new ones' edges matter.
+        ids = np.arange(first,count)
+        if first > 0:
+            ids = np.concatenate(
+                [np.flatnonzero(np.isin(keys[:first],keys[first:])),ids])
+
+        # Gather each edge's half-edges into a run, in id order.
+        order = np.argsort(keys[ids],kind='stable')
+        ids = ids[order]
+        runs = keys[ids]
+        n = len(ids)
+        if first == 0:
+            self.sorted_keys = runs
+            self.sorted_edges = ids
+            self.indexed = self.filed = count
+            self.recent.clear()
+        starts = np.flatnonzero(np.concatenate([[True],
+                                                runs[1:] != runs[:-1]]))
+        lengths = np.diff(np.append(starts,n))
+        start = np.repeat(starts,lengths)
+
+        # Find the latest earlier half-edge within the run going each
+        # way, as a position within the sorted ids, or -1.
+        at = np.arange(n)
+        forward = sources[ids] < targets[ids]
+        latest = []
+        for way in [forward, ~forward]:
+            before = np.maximum.accumulate(np.where(way,at,-1))
+            before = np.concatenate([[-1],before[:-1]])
+            latest.append(np.where(before >= start,before,-1))
+        same = np.where(forward,latest[0],latest[1])
+        other = np.where(forward,latest[1],latest[0])
+
+        # A half-edge from a vertex to itself is its own twin.
+        loop = sources[ids] == targets[ids]
+        partner = np.where(loop,at,other)
+        twins = np.where(partner >= 0,ids[np.maximum(partner,0)],-1)
+
+        # Each new half-edge is its twin's twin, unless a later one
+        # takes that place.
+        new = ids >= first
+        takers = np.full(n,-1)
+        linked = new & (partner >= 0)
+        np.maximum.at(takers,partner[linked],ids[linked])
+        final = np.where(takers >= 0,takers,twins)
+        changed = new | (takers >= 0)
+        self.twin[ids[changed]] = final[changed]
+
+        bad = np.sort(ids[new & (same >= 0)]) // 3
+        non_manifold = np.sort(ids[np.repeat(lengths > 2,lengths) & new])
+        return (bad, non_manifold)
+
+    #
+    # self.set_first_edges():
+    #
+    # The array version of vertex.set_first_edge, run on all the
+    # vertices at once.  Each works backwards around its fan from
+    # its out edge, through twins, for as long as that's possible.
+    #
+    def set_first_edges(self):
+        e = self.out.copy()
+        has_edge = e >= 0
+        active = np.zeros(len(e),dtype=bool)
+        active[has_edge] = (self.twin[e[has_edge]] >= 0) \
+                           & (e[has_edge] != self.out[has_edge])
+        while active.any():
+            e[active] = self.next[self.twin[e[active]]]
+            active[active] = (self.twin[e[active]] >= 0) \
+                             & (e[active] != self.out[active])
+        self.out = e
+        self.relinked()
+
+    #
+    # self.fans():
+    #
+    # The fan of edges around every vertex, as the arrays (centers,
+    # edges), giving the vertex and the edge of each step of its fan,
+    # with each vertex's steps together and in order.  These come
+    # from the mesh's adjacency indexes.
+    #
+    def fans(self):
+        return self.adjacency().fans()
+
+    #
+    # self.walk_fans():
+    #
+    # Walks the fan of edges around every vertex at once, just as
+    # class fan in scene.py walks one: from the vertex's out edge,
+    # across to each edge's next.next.twin, until there's no twin or
+    # the walk is back at the out edge.  Returns the arrays (centers,
+    # edges), giving the vertex and the edge of each step, a step of
+    # every vertex at a time.
+    #
+    # A walk is also cut off after as many steps as its vertex has
+    # out edges.  That can only happen around badly oriented faces,
+    # where the walk could otherwise go around forever.
+    #
+    def walk_fans(self):
+        limit = np.bincount(self.source,minlength=self.vertex_count())
+        centers = np.flatnonzero(self.out >= 0)
+        edges = self.out[centers]
+        all_centers = []
+        all_edges = []
+        steps = 0
+        while len(centers) > 0:
+            all_centers.append(centers)
+            all_edges.append(edges)
+            steps += 1
+            following = self.twin[self.next[self.next[edges]]]
+            going = (following >= 0) & (following != self.out[centers]) \
+                    & (limit[centers] > steps)
+            centers = centers[going]
+            edges = following[going]
+        if not all_centers:
+            return (np.zeros(0,dtype=np.int64), np.zeros(0,dtype=np.int32))
+        return (np.concatenate(all_centers), np.concatenate(all_edges))
+
+    #
+    # self.compute_face_normals():
+    #
+    # Computes the normal of every face the way face.normal does, as
+    # the cross product of the directions of its first two edges.
+    #
+    def compute_face_normals(self):
+        corners = self.positions[self.triangles()]
+        e0 = unit(corners[:,1] - corners[:,0])
+        e1 = unit(corners[:,2] - corners[:,1])
+        self.face_normals = cross(e0,e1)
+
+    #
+    # self.compute_normals(weighting='fan'):
+    #
+    # Computes a normal for each vertex that doesn't have one yet, by
+    # summing the normals of the faces around it and normalizing the
+    # sum.  The weighting says how each face counts:
+    #
+    #   'fan': its normal from compute_face_normals, summed in order
+    #          around the vertex's fan, giving just what vertex.normal
+    #          gives
+    #   'area': in proportion to its area
+    #   'angle': in proportion to its angle at the vertex
+    #
+    # A vertex with no faces gets the normal (1,0,0).
+    #
+    def compute_normals(self,weighting='fan'):
+        n = self.vertex_count()
+        x, y, z = self.normals[:,0], self.normals[:,1], self.normals[:,2]
+        missing = ~(np.sqrt(x*x + y*y + z*z) > EPSILON)
+        if not missing.any():
+            return
+
+        # Gather the weighted face normals at each corner.
+        if weighting == 'fan':
+            self.compute_face_normals()
+            centers, edges = self.fans()
+            keep = missing[centers]
+            centers = centers[keep]
+            weighted = self.face_normals[self.face[edges[keep]]]
+        elif weighting in ('area','angle'):
+            triangles = self.triangles()
+            corners = self.positions[triangles]
+            normals = cross(corners[:,1] - corners[:,0],
+                            corners[:,2] - corners[:,0])
+            centers = triangles.ravel()
+            if weighting == 'area':
+                weighted = np.repeat(normals * 0.5,3,axis=0)
+            else:
+                sides = np.roll(corners,-1,axis=1) - corners
+                lengths = np.sqrt((normals * normals).sum(axis=1))
+                angles = np.arctan2(
+                    np.linalg.norm(cross(sides,-np.roll(sides,1,axis=1)),
+                                   axis=2),
+                    (sides * -np.roll(sides,1,axis=1)).sum(axis=2))
+                directions = normals / np.where(lengths > 0.0,
+                                                lengths,1.0)[:,None]
+                weighted = (directions[:,None,:]
+                            * angles[:,:,None]).reshape(-1,3)
+        else:
+            raise ValueError('unknown normal weighting ' + repr(weighting))
+
+        # Sum them into their vertices.  Each vertex's sum is added up
+        # in the order its corners are given.
+        sums = np.zeros((3,n))
+        for j in range(3):
+            np.add.at(sums[j],centers,weighted[:,j])
+        self.normals[missing] = unit(sums.T[missing])
+
+    #
+    # self.rebox_transform():
+    #
+    # Gives the center and the scale used to rescale and center the
+    # mesh so that it fits within the viewing sphere.
+    #
+    def rebox_transform(self):
+        return rebox_transform(self.positions)
+
+    #
+    # self.rebox():
+    #
+    # Rescales and centers the vertex positions.
+    #
+    def rebox(self):
+        center, scale = self.rebox_transform()
+        self.positions = 0.0 + scale * (self.positions - center)
+        self.moved()
+
+
+#
+# rebox_transform(positions):
+#
+# Gives the center and the scale that mesh.rebox would use to
+# rescale and center the given n x 3 array of positions.
+#
+def rebox_transform(positions):
+    max_dims = np.full(3,np.finfo(np.float64).tiny)
+    min_dims = np.full(3,np.finfo(np.float64).max)
+    if len(positions) > 0:
+        max_dims = np.maximum(max_dims,positions.max(axis=0))
+        min_dims = np.minimum(min_dims,positions.min(axis=0))
+
+    center = min_dims + (max_dims - min_dims) * 0.5
+    span = max_dims - min_dims
+    scale = 1.8*np.sqrt(2.0)/np.sqrt(span[0]*span[0] +
+                                     span[1]*span[1] +
+                                     span[2]*span[2])
+    return center, float(scale)
+
+#
+# weld_map(positions,tolerance):
+#
+# Finds the vertices, of the given n x 3 array of positions, that
+# lie within the tolerance of one another, and gives back an array
+# of the id of the vertex each is welded to: the smallest id in its
+# cluster, where a cluster is joined by steps of no more than the
+# tolerance.  With a tolerance of 0, only vertices at the very same
+# position are welded.
+#
+# Nearby vertices are found with a spatial hash: space is cut into
+# cubes twice the size of the tolerance, so the vertices within the
+# tolerance of any point lie in the 2 x 2 x 2 block of cubes nearest
+# it.  Each vertex is filed in a hash table under its cube, and then
+# looks up the eight cubes of its block, in expected linear time.
+#
+def weld_map(positions,tolerance):
+    n = len(positions)
+    if n == 0:
+        return np.zeros(0,dtype=np.int64)
+    if tolerance <= 0.0:
+        _, first, inverse = np.unique(positions,axis=0,return_index=True,
+                                      return_inverse=True)
+        return first[inverse.ravel()]
+
+    # The hash table has a power of two slots, at least two for each
+    # vertex.  The vertices are filed in order of their slots, and
+    # bounds gives where each slot's vertices start.
+    mask = (1 << int(2*n).bit_length()) - 1
+    def slot(cells):
+        return ((cells[:,0] * 73856093) ^ (cells[:,1] * 19349663)
+                ^ (cells[:,2] * 83492791)) & mask
+
+    scaled = positions / (2.0 * tolerance)
+    slots = slot(np.floor(scaled).astype(np.int64))
+    filed = np.argsort(slots,kind='stable')
+    bounds = np.concatenate([[0],np.cumsum(np.bincount(slots,
+                                                       minlength=mask+1))])
+
+    # Pair each vertex with those filed in the slots of its block,
+    # keeping the pairs close enough to weld, each with its larger id
+    # first.
+    ids = np.arange(n)
+    corner = np.floor(scaled - 0.5).astype(np.int64)
+    firsts = []
+    seconds = []
+    for offset in np.indices((2,2,2)).reshape(3,-1).T:
+        near = slot(corner + offset)
+        lo = bounds[near]
+        counts = bounds[near + 1] - lo
+        i = np.repeat(ids,counts)
+        j = filed[np.repeat(lo - (np.cumsum(counts) - counts),counts)
+                  + np.arange(len(i))]
+        keep = j < i
+        i, j = i[keep], j[keep]
+        d = positions[i] - positions[j]
+        close = (d * d).sum(axis=1) <= tolerance * tolerance
+        firsts.append(i[close])
+        seconds.append(j[close])
+    i = np.concatenate(firsts)
+    j = np.concatenate(seconds)
+
+    # Spread the smallest id through each cluster.
+    labels = ids
+    while True:
+        lower = labels.copy()
+        np.minimum.at(lower,i,labels[j])
+        np.minimum.at(lower,j,labels[i])
+        lower = lower[lower]
+        if np.array_equal(lower,labels):
+            return labels
+        labels = lower
+
+#
+# unit(vectors):
+#
+# The rows of the given n x 3 array scaled to unit length, computed
+# just as vector.unit computes them.  Rows too short to scale are
+# replaced by (1,0,0).
+#
+def unit(vectors):
+    x, y, z = vectors[:,0], vectors[:,1], vectors[:,2]
+    lengths = np.sqrt(x*x + y*y + z*z)
+    return np.where(lengths[:,None] < EPSILON, [1.0,0.0,0.0],
+                    vectors * (1.0/np.maximum(lengths,EPSILON))[:,None])
+
+#
+# cross(u,v):
+#
+# The cross products of corresponding rows of two n x 3 arrays,
+# computed just as vector.cross computes them.
+#
+def cross(u,v):
+    w = np.empty(np.broadcast_shapes(u.shape,v.shape))
+    w[...,0] = u[...,1]*v[...,2] - u[...,2]*v[...,1]
+    w[...,1] = u[...,2]*v[...,0] - u[...,0]*v[...,2]
+    w[...,2] = u[...,0]*v[...,1] - u[...,1]*v[...,0]
+    return w
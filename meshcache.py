@@ -0,0 +1,142 @@
+#
+# meshcache.py
+#
+# A binary sidecar cache for meshes read from .obj files.  Reading
+# a file through scene.read parses it, builds its half-edges, and
+# computes and smooths its vertex normals.  The results of all that
+# work are saved next to the .obj file, e.g. objs/bunny.obj gets
+# objs/bunny.obj.meshcache, so that later reads of an unchanged file
+# can just map them back in.
+#
+# A cache file is laid out as
+#
+#   MAGIC, then the length of a JSON header as a little-endian uint32,
+#   then the JSON header itself, then each array's raw bytes.
+#
+# The header records the size, modification time, and SHA-1 digest
+# of the .obj file the cache was made from, plus the dtype, shape,
+# and byte offset of each array.  A cache is only used when all
+# three of those match the .obj file as it is now.
+#
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import numpy as np
+
+MAGIC = b'MESHCACHE\x00\x01\x00'
+SUFFIX = '.meshcache'
+ALIGN = 64
+
+#
+# path_for(filename):
+#
+# The name of the cache file for the given .obj file.
+#
+def path_for(filename):
+    return filename + SUFFIX
+
+#
+# key(filename):
+#
+# The size, modification time, and content digest of a file.
+#
+def key(filename):
+    info = os.stat(filename)
+    digest = hashlib.sha1()
+    with open(filename,'rb') as source:
+        for block in iter(lambda: source.read(1 << 22), b''):
+            digest.update(block)
+    return {'size': info.st_size,
+            'mtime': info.st_mtime_ns,
+            'sha1': digest.hexdigest()}
+
+#
+# load(filename):
+#
+# Returns a dictionary of the arrays cached for the given .obj
+# file, each memory-mapped read-only from the cache file.  Returns
+# None if there is no cache, if the .obj file has changed since the
+# cache was written, or if the cache is damaged, e.g. cut short.
+#
+def load(filename):
+    path = path_for(filename)
+    try:
+        with open(path,'rb') as cache_file:
+            if cache_file.read(len(MAGIC)) != MAGIC:
+                return None
+            (length,) = struct.unpack('<I',cache_file.read(4))
+            header = json.loads(cache_file.read(length).decode('utf-8'))
+            size = os.fstat(cache_file.fileno()).st_size
+        info = os.stat(filename)
+
+        # Check the cheap parts of the key before hashing the file.
+        source = header['source']
+        if source['size'] != info.st_size or \
+           source['mtime'] != info.st_mtime_ns:
+            return None
+        if key(filename) != source:
+            return None
+
+        arrays = { }
+        for name,entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            shape = tuple(entry['shape'])
+            if 0 in shape:
+                arrays[name] = np.zeros(shape,dtype=dtype)
+                continue
+            if entry['offset'] + dtype.itemsize * int(np.prod(shape)) > size:
+                return None
+            arrays[name] = np.memmap(path,dtype=dtype,mode='r',
+                                     offset=entry['offset'],shape=shape)
+    except (OSError, KeyError, TypeError, ValueError, struct.error):
+        return None
+    return arrays
+
+#
+# save(filename,arrays,source=None):
+#
+# Writes the given dictionary of arrays to the cache file for the
+# given .obj file.  The key of the .obj file is computed unless it
+# is given as source.  Does nothing if the cache can't be written.
+#
+def save(filename,arrays,source=None):
+    if source is None:
+        source = key(filename)
+    arrays = {name: np.ascontiguousarray(a) for name,a in arrays.items()}
+
+    # Lay out the arrays after the header, each on an aligned offset.
+    # The offsets depend on the header's length, so settle that first.
+    entries = {name: {'dtype': a.dtype.str, 'shape': list(a.shape),
+                      'offset': 0}
+               for name,a in arrays.items()}
+    while True:
+        header = json.dumps({'source': source,
+                             'arrays': entries}).encode('utf-8')
+        offset = len(MAGIC) + 4 + len(header)
+        moved = False
+        for name,a in arrays.items():
+            offset += -offset % ALIGN
+            if entries[name]['offset'] != offset:
+                entries[name]['offset'] = offset
+                moved = True
+            offset += a.nbytes
+        if not moved:
+            break
+
+    path = path_for(filename)
+    temporary = path + '.%d.%d.tmp' % (os.getpid(),threading.get_ident())
+    try:
+        with open(temporary,'wb') as cache_file:
+            cache_file.write(MAGIC)
+            cache_file.write(struct.pack('<I',len(header)))
+            cache_file.write(header)
+            for name,a in arrays.items():
+                cache_file.seek(entries[name]['offset'])
+                cache_file.write(a.tobytes())
+        os.replace(temporary,path)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
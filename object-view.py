@@ -12,12 +12,16 @@
 #
 
 import sys
+import time
+import instrument
+from framestats import framestats
 from geometry import point, vector, EPSILON, ORIGIN
 from quat import quat
 from scene import vertex, edge, face, scene
 from random import random
 from math import sin, cos, acos, asin, pi, sqrt
 from ctypes import *
+import numpy as np
 
 from OpenGL.GL import *
 from OpenGL.GLUT import *
@@ -35,15 +39,63 @@ last_selected_face = None
 vertex_buffer = None
 normal_buffer = None
 color_buffer = None
+index_buffer = None
+index_type = None
 colors = None
+indices = None
 shaders = None
 
+# The shader variables' locations, looked up once the shaders are
+# linked, and the vertex array objects that hold the attribute
+# bindings for drawing the scene and its highlighted faces.
+h_vertex = None
+h_normal = None
+h_color = None
+h_eye = None
+h_light = None
+h_modelview = None
+scene_vao = None
+highlight_vao = None
+
+# The model-view matrix given by the trackball, and the eye and light
+# positions, as handed to the shaders.  These are only worked out
+# again, by update_view, after the trackball or flashlight turns.
+view = None
+
+# The highlighted faces are drawn again, in green, over the others.
+# Their corner indices are kept in a buffer with room for more, so
+# that highlighting a face only uploads its own three indices.
+rgb_selected = [0.7,0.9,0.6] #GREEN
+highlighted = set()
+highlight_corners = None
+highlight_buffer = None
+
 xStart = 0
 yStart = 0
+
+# Frame pacing.  Mouse motion is only noted as it comes in, and the
+# whole drag since the last frame becomes one trackball rotation when
+# the next frame is drawn.  Frames are drawn at most once per frame
+# budget, in seconds; it can be set from the command line as a
+# target frame rate.
+frame_budget = 1.0/60.0
+last_frame = 0.0
+redraw_scheduled = False
+drag = None
 width = 512
 height = 512
 scale = 1.0/min(width,height)
 
+# Rolling statistics of the time spent drawing, handling motion, and
+# picking, and of the bytes uploaded each frame.  When they're shown,
+# they're drawn over the scene and printed every REPORT_PERIOD
+# seconds.  They can be saved, a row for each frame, to STATS_FILE.
+stats = framestats()
+show_stats = False
+last_report = 0.0
+REPORT_PERIOD = 1.0
+STATS_FILE = 'object-view-stats.csv'
+
 def init_shaders():
     """Compile the vertex and fragment shaders from source."""
     global shaders
@@ -75,82 +127,164 @@ def init_shaders():
     glAttachShader(shaders,fragment_shader)
     glLinkProgram(shaders)
 
-
-def draw():
-    """ Issue GL calls to draw the scene. """
-    global trackball, flashlight, \
-           vertex_buffer, normal_buffer, \
-           colors, color_buffer, selected_face, add_face, \
-           shaders
-
-    # Clear the rendering information.
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-    # Clear the transformation stack.
-    glMatrixMode(GL_MODELVIEW)
-    glLoadIdentity()
-
-    glPushMatrix()
-
-    # Transform the objects drawn below by a rotation.
-    trackball.glRotate()
-
-    # * * * * * * * * * * * * * * * *
-    # Draw all the triangular facets.
-    glUseProgram(shaders)
-
+    # look up where everything goes, once and for all
+    global h_vertex, h_normal, h_color, h_eye, h_light, h_modelview
     h_vertex = glGetAttribLocation(shaders,'vertex')
     h_normal = glGetAttribLocation(shaders,'normal')
     h_color = glGetAttribLocation(shaders,'color')
     h_eye =    glGetUniformLocation(shaders,'eye')
     h_light =  glGetUniformLocation(shaders,'light')
+    h_modelview = glGetUniformLocation(shaders,'modelview')
+
+def init_arrays():
+    """Capture the attribute bindings of the scene and highlight draws."""
+    global scene_vao, highlight_vao
+
+    # all the vertex positions, normals, and colors, and all the faces
+    scene_vao = glGenVertexArrays(1)
+    glBindVertexArray(scene_vao)
+    bind_attribute(h_vertex, vertex_buffer)
+    bind_attribute(h_normal, normal_buffer)
+    bind_attribute(h_color, color_buffer)
+    glBindBuffer (GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+
+    # the same positions and normals, but only the highlighted faces,
+    # all one color
+    highlight_vao = glGenVertexArrays(1)
+    glBindVertexArray(highlight_vao)
+    bind_attribute(h_vertex, vertex_buffer)
+    bind_attribute(h_normal, normal_buffer)
+    glDisableVertexAttribArray(h_color)
+    glBindBuffer (GL_ELEMENT_ARRAY_BUFFER, highlight_buffer)
 
-    # all the vertex positions
-    glEnableVertexAttribArray(h_vertex)
-    glBindBuffer (GL_ARRAY_BUFFER, vertex_buffer)
-    glVertexAttribPointer(h_vertex, 3, GL_FLOAT, GL_FALSE, 0, None)
-        
-    # all the vertex normals
-    glEnableVertexAttribArray(h_normal)
-    glBindBuffer (GL_ARRAY_BUFFER, normal_buffer)
-    glVertexAttribPointer(h_normal, 3, GL_FLOAT, GL_FALSE, 0, None)
+    glBindVertexArray(0)
 
-    # all the face vertex colors
-    glEnableVertexAttribArray(h_color)
-    glBindBuffer (GL_ARRAY_BUFFER, color_buffer)
+def bind_attribute(h, buffer):
+    """Feed shader attribute h with 3 floats per vertex from a buffer."""
+    glEnableVertexAttribArray(h)
+    glBindBuffer (GL_ARRAY_BUFFER, buffer)
+    glVertexAttribPointer(h, 3, GL_FLOAT, GL_FALSE, 0, None)
 
-    if selected_face and add_face:
-        # paint that face's vertices Green
-        rgb_selected = [0.7,0.9,0.6] #GREEN
-        for change in range(9):
-            colors[selected_face.id * 9 + change] = rgb_selected[change % 3]
-        # update the color buffer
-        glBufferData (GL_ARRAY_BUFFER, len(colors)*4, 
-                      (c_float*len(colors))(*colors), GL_STATIC_DRAW)
-        add_face = False
 
-    glVertexAttribPointer(h_color, 3, GL_FLOAT, GL_FALSE, 0, None)
-        
-    # position of the flashlight
-    light = flashlight.rotate(vector(0.0,0.0,1.0));
-    glUniform3fv(h_light, 1, (2.0*radius*light).components())
+def draw():
+    """ Issue GL calls to draw the scene. """
+    global trackball, flashlight, selected_face, add_face, \
+           last_frame, redraw_scheduled
 
-    # position of the viewer's eye
-    eye = trackball.recip().rotate(vector(0.0,0.0,1.0))
-    glUniform3fv(h_eye, 1, eye.components())
+    redraw_scheduled = False
+    last_frame = time.perf_counter()
+    apply_drag()
 
-    glDrawArrays (GL_TRIANGLES, 0, len(face.instances) * 3)
+    # Clear the rendering information.
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-    glDisableVertexAttribArray(h_vertex)
-    glDisableVertexAttribArray(h_normal)
-    glDisableVertexAttribArray(h_color)
+    if selected_face and add_face:
+        highlight(selected_face)
+        add_face = False
 
-    glPopMatrix()
+    # * * * * * * * * * * * * * * * *
+    # Draw all the triangular facets.
+
+    if view is None:
+        update_view()
+    modelview, eye, light = view
+
+    # the rotation of the trackball, the position of the flashlight,
+    # and the position of the viewer's eye
+    glUniformMatrix4fv(h_modelview, 1, GL_FALSE, modelview)
+    glUniform3fv(h_light, 1, light)
+    glUniform3fv(h_eye, 1, eye)
+
+    # all the faces, by their corners' vertex indices
+    glBindVertexArray(scene_vao)
+    glDrawElements (GL_TRIANGLES, len(indices), gl_index_type(), None)
+
+    # the highlighted faces again, painted Green, passing the depth
+    # test where they're drawn over themselves (the color is set
+    # each time, since drawing the scene can leave it undefined)
+    if highlighted:
+        glBindVertexArray(highlight_vao)
+        glVertexAttrib3f(h_color, *rgb_selected)
+        glDepthFunc (GL_LEQUAL)
+        glDrawElements (GL_TRIANGLES, len(highlighted) * 3, gl_index_type(),
+                        None)
+        glDepthFunc (GL_LESS)
+
+    if show_stats:
+        draw_stats()
 
     # Render the scene.
     glFlush()
 
     glutSwapBuffers()
+    stats.frame(last_frame, time.perf_counter() - last_frame)
+    report_stats()
+
+def draw_stats():
+    """ Write the latest frame statistics over the top left corner. """
+    glUseProgram(0)
+    glBindVertexArray(0)
+    glDisable(GL_DEPTH_TEST)
+    glColor3f(1.0, 1.0, 1.0)
+    for i,line in enumerate(stats.lines()):
+        glWindowPos2i(8, height - 16*(i+1))
+        glutBitmapString(GLUT_BITMAP_8_BY_13, line.encode())
+    glEnable(GL_DEPTH_TEST)
+    glUseProgram(shaders)
+
+def report_stats():
+    """ Print the frame statistics, if shown, every so often. """
+    global last_report
+    now = time.perf_counter()
+    if show_stats and now - last_report >= REPORT_PERIOD:
+        stats.report()
+        last_report = now
+
+def update_view():
+    """ Work out the view given by the trackball and flashlight. """
+    global view
+
+    rotation = trackball.matrix()
+    modelview = trackball.as_gl_matrix()
+
+    # The eye looks down the trackball's unrotated z axis, and the
+    # flashlight shines from along its own rotated z axis.
+    eye = rotation[2].astype(np.float32)
+    light = (2.0*radius*flashlight.matrix()[:,2]).astype(np.float32)
+    view = (modelview, eye, light)
+
+def highlight(f):
+    """ Add face f to the highlighted faces. """
+    global highlight_corners
+
+    if f.id in highlighted:
+        return
+    count = len(highlighted)
+    glBindVertexArray(highlight_vao)
+
+    # When the buffer is full, double its room and upload it whole.
+    if count == len(highlight_corners):
+        more = np.zeros((2*count,3),dtype=index_type)
+        more[:count] = highlight_corners
+        highlight_corners = more
+        glBufferData (GL_ELEMENT_ARRAY_BUFFER, highlight_corners.nbytes,
+                      highlight_corners, GL_DYNAMIC_DRAW)
+        stats.upload(highlight_corners.nbytes)
+
+    # Otherwise only upload the new face's corners.
+    highlight_corners[count] = indices[3*f.id:3*f.id+3]
+    row = highlight_corners[count]
+    glBufferSubData (GL_ELEMENT_ARRAY_BUFFER, count * row.nbytes, row.nbytes,
+                     row)
+    stats.upload(row.nbytes)
+    highlighted.add(f.id)
+
+def gl_index_type():
+    """ The GL type of the entries of the index buffers. """
+    if index_type == np.uint16:
+        return GL_UNSIGNED_SHORT
+    else:
+        return GL_UNSIGNED_INT
 
 def move_face(dir):
     global last_selected_face, selected_face, add_face
@@ -158,23 +292,27 @@ def move_face(dir):
     D = {'LEFT':2, 'RIGHT':1}
     d = D[dir]
 
-    # find which edge is the backwards hop edge
+    # find which edge is the backwards hop edge, from the faces
+    # across the selected face's edges
+    M = selected_face.mesh
+    across = M.adjacency().across()[selected_face.id].tolist()
     last = 0
     for i in [0,1,2]:
-        e = selected_face.edge(i)
-        if e.twin and e.twin.face == last_selected_face:
+        if across[i] >= 0 and last_selected_face is not None \
+           and across[i] == last_selected_face.id:
             last = i
-    e = selected_face.edge((last+d)%3)
+    f = across[(last+d)%3]
 
     # highlight that next face
-    if e.twin:
+    if f >= 0:
        last_selected_face = selected_face
-       selected_face = e.twin.face
+       selected_face = face(f,M)
        add_face = True
-       glutPostRedisplay()
+       request_redraw()
 
 def keyboard(key, x, y):
     """ Handle a "normal" keypress. """
+    global show_stats
 
     # Handle ESC key.
     if key == b'\033':	
@@ -187,13 +325,29 @@ def keyboard(key, x, y):
     if key == b'.' and selected_face:
         move_face('RIGHT')
 
+    # Print the times and counts of loading the scene.
+    if key == b'i':
+        instrument.report()
+
+    # Show or hide the frame statistics, or save them.
+    if key == b's':
+        show_stats = not show_stats
+        request_redraw()
+
+    if key == b'c':
+        stats.save_csv(STATS_FILE)
+        print('Saved %d frames of statistics to %s.' %
+              (len(stats.rows), STATS_FILE))
+
 
 def arrow(key, x, y):
     """ Handle a "special" keypress. """
-    global trackball,flashlight
+    global trackball,flashlight,view
 
-    x_axis = trackball.recip().rotate(vector(1.0,0.0,0.0))
-    y_axis = trackball.recip().rotate(vector(0.0,1.0,0.0))
+    # (the trackball's inverse rotation takes x and y to its matrix's rows)
+    rotation = trackball.matrix()
+    x_axis = vector.with_components(rotation[0].tolist())
+    y_axis = vector.with_components(rotation[1].tolist())
 
     # Apply an adjustment to the overall rotation.
     if key == GLUT_KEY_DOWN:
@@ -204,41 +358,75 @@ def arrow(key, x, y):
         flashlight = quat.for_rotation(-pi/12.0,y_axis) * flashlight
     if key == GLUT_KEY_RIGHT:
         flashlight = quat.for_rotation( pi/12.0,y_axis) * flashlight
+    view = None
 
     # Redraw.
-    glutPostRedisplay()
+    request_redraw()
 
 
 def mouse(button, state, x, y):
     global xStart, yStart, trackball, selected_face, add_face
+
+    # Finish off any drag before starting a new one.
+    apply_drag()
     xStart = (x - width/2) * scale
     yStart = (height/2 - y) * scale
 
     if glutGetModifiers() == GLUT_ACTIVE_SHIFT and state == GLUT_DOWN:
-        minus_z = trackball.recip().rotate(vector(0.0,0.0,-1.0))
-        click = trackball.recip().rotate(vector(xStart,yStart,2.0))
+        recip = trackball.matrix().T
+        minus_z = vector.with_components(recip.dot([0.0,0.0,-1.0]).tolist())
+        click = vector.with_components(recip.dot([xStart,yStart,2.0]).tolist())
+        start = time.perf_counter()
         selected_face = scene.intersect_ray(ORIGIN+click,minus_z)
+        stats.pick(time.perf_counter() - start)
         add_face = True
         
-    glutPostRedisplay()
+    request_redraw()
 
 def motion(x, y):
-    global trackball, xStart, yStart
-    xNow = (x - width/2) * scale
-    yNow = (height/2 - y) * scale
+    global drag
+    start = time.perf_counter()
+    # Just note where the drag has reached, for the next frame.
+    drag = ((x - width/2) * scale, (height/2 - y) * scale)
+    request_redraw()
+    stats.motion(time.perf_counter() - start)
+
+def apply_drag():
+    """ Turn the trackball by the drag made since the last frame. """
+    global trackball, xStart, yStart, drag, view
+    if drag is None:
+        return
+    xNow, yNow = drag
+    drag = None
     change = point(xNow,yNow,0.0) - point(xStart,yStart,0.0)
     axis = vector(-change.dy,change.dx,0.0)
     sin_angle = change.norm()/radius
     sin_angle = max(min(sin_angle,1.0),-1.0) # clip
     angle = asin(sin_angle)
     trackball = quat.for_rotation(angle,axis) * trackball
+    view = None
     xStart,yStart = xNow, yNow
 
+def request_redraw():
+    """ Ask for a redraw, once the frame budget since the last allows. """
+    global redraw_scheduled
+    if redraw_scheduled:
+        return
+    redraw_scheduled = True
+    wait = last_frame + frame_budget - time.perf_counter()
+    if wait > 0.0:
+        glutTimerFunc(int(wait * 1000.0) + 1, post_redraw, 0)
+    else:
+        glutPostRedisplay()
+
+def post_redraw(value):
+    """ Timer callback for a redraw put off by request_redraw. """
     glutPostRedisplay()
 
 def init(filename):
     """ Initialize aspects of the GL scene rendering.  """
-    global trackball, flashlight, vertex_buffer, normal_buffer, color_buffer, colors, vertices, normals
+    global trackball, flashlight, vertex_buffer, normal_buffer, color_buffer, colors, vertices, normals, \
+           index_buffer, index_type, indices, highlight_buffer, highlight_corners
 
     # initialize quaternions for the light and trackball
     flashlight = quat.for_rotation(0.0,vector(1.0,0.0,0.0))
@@ -246,26 +434,37 @@ def init(filename):
 
     # read the .OBJ file into VBOs
     scene.read(filename)
-    vertices,normals,colors = scene.compile()
-    
+    vertices,normals,colors,indices = scene.compile(indexed=True)
+    index_type = indices.dtype.type
+
+    # (the arrays are uploaded as they are, without copying)
     vertex_buffer = glGenBuffers(1)
     glBindBuffer (GL_ARRAY_BUFFER, vertex_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(vertices)*4, 
-                  (c_float*len(vertices))(*vertices), GL_STATIC_DRAW)
+    glBufferData (GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
 
     normal_buffer = glGenBuffers(1)
     glBindBuffer (GL_ARRAY_BUFFER, normal_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(normals)*4, 
-                  (c_float*len(normals))(*normals), GL_STATIC_DRAW)
+    glBufferData (GL_ARRAY_BUFFER, normals.nbytes, normals, GL_STATIC_DRAW)
 
     color_buffer = glGenBuffers(1)
     glBindBuffer (GL_ARRAY_BUFFER, color_buffer)
-    glBufferData (GL_ARRAY_BUFFER, len(colors)*4, 
-                  (c_float*len(colors))(*colors), GL_STATIC_DRAW)
+    glBufferData (GL_ARRAY_BUFFER, colors.nbytes, colors, GL_STATIC_DRAW)
+
+    index_buffer = glGenBuffers(1)
+    glBindBuffer (GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+    glBufferData (GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices,
+                  GL_STATIC_DRAW)
 
+    highlight_corners = np.zeros((64,3),dtype=index_type)
+    highlight_buffer = glGenBuffers(1)
+    glBindBuffer (GL_ELEMENT_ARRAY_BUFFER, highlight_buffer)
+    glBufferData (GL_ELEMENT_ARRAY_BUFFER, highlight_corners.nbytes,
+                  highlight_corners, GL_DYNAMIC_DRAW)
 
-    # set up the object shaders
+    # set up the object shaders, and the attribute bindings
     init_shaders()
+    init_arrays()
+    glUseProgram(shaders)
 
     glEnable (GL_DEPTH_TEST)
 
@@ -291,12 +490,20 @@ def resize(w, h):
 
 def main(argc, argv):
     """ The main procedure, sets up GL and GLUT. """
+    global frame_budget
+
+    # An optional second argument gives the target frame rate.
+    if argc > 2:
+        frame_budget = 1.0 / float(argv[2])
 
     glutInit(argv)
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
     glutInitWindowPosition(0, 20)
     glutInitWindowSize(width, height)
     glutCreateWindow( 'object-view.py - Press ESC to quit' )
+
+    # Time the stages of loading (and compiling) the scene.
+    instrument.enable()
     init(argv[1])
 
     # Register interaction callbacks.
@@ -309,6 +516,8 @@ def main(argc, argv):
 
     print()
     print('Press the arrow keys move the flashlight.')
+    print('Press i for a summary of the time spent loading.')
+    print('Press s to show or hide frame statistics, c to save them.')
     print('Press ESC to quit.\n')
     print()
 
@@ -0,0 +1,401 @@
+#
+# objfile.py
+#
+# A bulk reader for Alias/Wavefront .obj files.  Rather than
+# splitting the file one line at a time, it reads the file in large
+# blocks and tokenizes each block with NumPy array operations, so
+# that the vertex, normal, and face records come out as contiguous
+# arrays:
+#
+#   positions: an n x 3 float64 array of the "v" coordinates
+#   normals: an m x 3 float64 array of the "vn" directions
+#   triangles: a t x 3 int32 array of 0-based vertex indices
+#
+# Face lines can refer to their corners either by a plain vertex
+# index or by a v/vt/vn index triplet.  Only the vertex index is
+# kept.  Faces with more than three corners are split into a fan of
+# triangles around their first corner.  Negative (relative) indices
+# refer back from the most recent "v" line.
+#
+# A large file can be read by several worker processes at once.  It
+# is split at line boundaries into byte ranges, one for each worker,
+# and each range is read as though it were a file of its own.  Its
+# negative indices then refer back from the vertices of its own
+# range, so the worker marks which corners came from them.  Once the
+# pieces are back, those corners are shifted by the number of
+# vertices in the ranges before, and the pieces are joined.
+#
+# A file can also be streamed, through a pipeline of generators:
+#
+#   blocks: the file's text, a block of complete lines at a time
+#   records: the vertex, normal, and triangle arrays of each block
+#   batches: the triangles, in arrays of a fixed number of rows
+#
+# These hold just a block of the file at once, so consumers like
+# bounds and counts, below, read files of any size in a fixed
+# amount of memory.
+#
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Bytes read per block.  Each block gets a handful of scratch arrays
+# with one entry per byte, so this bounds the reader's working memory.
+BLOCK_SIZE = 1 << 22
+
+# Triangles given in each batch by the batches stage.
+BATCH_SIZE = 1 << 16
+
+SPACE = ord(' ')
+NEWLINE = ord('\n')
+SLASH = ord('/')
+WHITESPACE = bytes.maketrans(b'\t\r\v\f',b'    ')
+
+#
+# read(filename,processes=1):
+#
+# Reads the .obj file with the given name, giving back the arrays
+# (positions, normals, triangles) described above.  The file is
+# read by a pool of the given number of worker processes, though
+# never with less than a block for each.
+#
+def read(filename,processes=1):
+    count = min(processes,max(os.path.getsize(filename) // BLOCK_SIZE,1))
+    if count <= 1:
+        return read_range(filename)[:3]
+
+    ranges = split(filename,count)
+    with ProcessPoolExecutor(max_workers=count) as pool:
+        pieces = list(pool.map(read_range,[filename]*count,
+                               [start for start,stop in ranges],
+                               [stop for start,stop in ranges]))
+    return join(pieces)
+
+#
+# split(filename,count):
+#
+# Splits the .obj file with the given name into (at most) the given
+# number of byte ranges, each as (start, stop), about as long as one
+# another, and each ending just after a newline or at the end.
+#
+def split(filename,count):
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename,'rb') as obj_file:
+        for i in range(1,count):
+            # Move the bound up to just after the next newline.
+            at = max(size * i // count,bounds[-1])
+            obj_file.seek(at)
+            while True:
+                block = obj_file.read(1 << 16)
+                if not block:
+                    at = size
+                    break
+                cut = block.find(b'\n')
+                if cut >= 0:
+                    at += cut + 1
+                    break
+                at += len(block)
+            if at > bounds[-1] and at < size:
+                bounds.append(at)
+    bounds.append(size)
+    return list(zip(bounds[:-1],bounds[1:]))
+
+#
+# read_range(filename,start=0,stop=None):
+#
+# Reads the lines of the .obj file with the given name from byte
+# start up to byte stop (or the end), which should fall on line
+# boundaries, as though they were the whole file.  Gives back the
+# arrays (positions, normals, triangles, relative), where relative
+# marks the triangle corners given by negative indices, or is None
+# if there are none.
+#
+def read_range(filename,start=0,stop=None):
+    positions = []
+    normals = []
+    triangles = []
+    relatives = []
+    vertex_count = 0
+    for block in blocks(filename,start,stop):
+        P, N, T, R = parse_records(block,vertex_count)
+        positions.append(P)
+        normals.append(N)
+        triangles.append(T)
+        relatives.append(R)
+        vertex_count += len(P)
+
+    relative = None
+    if any(R is not None for R in relatives):
+        relative = np.concatenate(
+            [np.zeros(T.shape,dtype=bool) if R is None else R
+             for T,R in zip(triangles,relatives)])
+    return (np.concatenate(positions) if positions else np.zeros((0,3)),
+            np.concatenate(normals) if normals else np.zeros((0,3)),
+            np.concatenate(triangles) if triangles
+            else np.zeros((0,3),dtype=np.int32),
+            relative)
+
+#
+# blocks(filename,start=0,stop=None):
+#
+# The first stage of reading the .obj file with the given name, from
+# byte start up to byte stop (or the end): a generator of the file's
+# text in blocks of complete lines, each ending in a newline.
+#
+def blocks(filename,start=0,stop=None):
+    with open(filename,'rb') as obj_file:
+        obj_file.seek(start)
+        left = os.path.getsize(filename) - start if stop is None \
+               else stop - start
+        rest = b''
+        while left > 0:
+            block = obj_file.read(min(BLOCK_SIZE,left))
+            if not block:
+                break
+            left -= len(block)
+            # Only give up to the last complete line of the block.
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            rest = block[cut:]
+            if cut > 0:
+                yield block[:cut]
+
+        # Give a final line that has no newline.
+        if rest.strip():
+            yield rest + b'\n'
+
+#
+# records(filename):
+#
+# The second stage: a generator of the arrays (positions, normals,
+# triangles) for each block of the .obj file with the given name,
+# with the triangle indices counted from the start of the file.
+#
+def records(filename):
+    vertex_count = 0
+    for block in blocks(filename):
+        positions, normals, triangles = parse_block(block,vertex_count)
+        vertex_count += len(positions)
+        yield (positions, normals, triangles)
+
+#
+# batches(filename,size=BATCH_SIZE):
+#
+# The last stage: a generator of the triangles of the .obj file with
+# the given name, as arrays of at most size rows of 0-based vertex
+# indices.
+#
+def batches(filename,size=BATCH_SIZE):
+    waiting = []
+    count = 0
+    for positions, normals, triangles in records(filename):
+        waiting.append(triangles)
+        count += len(triangles)
+        if count >= size:
+            triangles = np.concatenate(waiting)
+            whole = count - count % size
+            for first in range(0,whole,size):
+                yield triangles[first:first+size]
+            waiting = [triangles[whole:]]
+            count -= whole
+    if count > 0:
+        yield np.concatenate(waiting)
+
+#
+# bounds(filename):
+#
+# The smallest and largest coordinates of the vertices of the .obj
+# file with the given name, as two arrays of 3, read a block at a
+# time.  Gives back None if there are no vertices.
+#
+def bounds(filename):
+    low = high = None
+    for positions, normals, triangles in records(filename):
+        if len(positions) == 0:
+            continue
+        if low is None:
+            low = positions.min(axis=0)
+            high = positions.max(axis=0)
+        else:
+            low = np.minimum(low,positions.min(axis=0))
+            high = np.maximum(high,positions.max(axis=0))
+    return None if low is None else (low, high)
+
+#
+# counts(filename):
+#
+# The numbers of vertices, normals, and triangles in the .obj file
+# with the given name, read a block at a time.
+#
+def counts(filename):
+    totals = [0, 0, 0]
+    for arrays in records(filename):
+        for i in range(3):
+            totals[i] += len(arrays[i])
+    return tuple(totals)
+
+#
+# join(pieces):
+#
+# Joins the pieces given by read_range for the consecutive ranges of
+# a file into the arrays (positions, normals, triangles) for the
+# whole file, shifting the corners given by negative indices in each
+# piece by the number of vertices in the pieces before it.
+#
+def join(pieces):
+    vertex_count = 0
+    triangles = []
+    for P, N, T, relative in pieces:
+        if relative is not None and vertex_count > 0:
+            T = T + np.where(relative,vertex_count,0).astype(T.dtype)
+        triangles.append(T)
+        vertex_count += len(P)
+    return (np.concatenate([piece[0] for piece in pieces]),
+            np.concatenate([piece[1] for piece in pieces]),
+            np.concatenate(triangles))
+
+#
+# parse_block(text,vertex_base):
+#
+# Tokenizes a run of complete .obj lines, each ending in a newline.
+# The value vertex_base gives the number of vertices read before
+# this run, and is used to resolve negative face indices.  Gives
+# back the arrays (positions, normals, triangles) for the run, with
+# the triangle indices counted from the start of the file.
+#
+def parse_block(text,vertex_base=0):
+    return parse_records(text,vertex_base)[:3]
+
+#
+# parse_records(text,vertex_base):
+#
+# Does the work of parse_block, giving back the arrays (positions,
+# normals, triangles, relative), where relative marks the triangle
+# corners given by negative indices, or is None if there are none.
+#
+def parse_records(text,vertex_base=0):
+
+    # Treat tabs, carriage returns, etc. as spaces, and drop any
+    # indentation so that each line starts with its keyword.
+    text = text.translate(WHITESPACE)
+    if text[:1] == b' ' or b'\n ' in text:
+        text = b'\n'.join(line.lstrip() for line in text.split(b'\n'))
+    buf = np.frombuffer(text,dtype=np.uint8)
+
+    # Find the lines and classify them by their keyword.
+    ends = np.flatnonzero(buf == NEWLINE)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    last = len(buf) - 1
+    c0 = buf[starts]
+    c1 = buf[np.minimum(starts+1,last)]
+    c2 = buf[np.minimum(starts+2,last)]
+    is_v = (c0 == ord('v')) & (c1 == SPACE)
+    is_vn = (c0 == ord('v')) & (c1 == ord('n')) & (c2 == SPACE)
+    is_f = (c0 == ord('f')) & (c1 == SPACE)
+
+    def gather(is_kind,skip):
+        # The text of the lines of one kind, minus their keywords.
+        drop = np.where(is_kind,skip,ends + 1 - starts)
+        keep = ends + 1 - starts - drop
+        lengths = np.stack([drop,keep],axis=1).ravel()
+        pattern = np.tile([False,True],len(starts))
+        return buf[np.repeat(pattern,lengths)]
+
+    def numbers(lines,count,width,dtype):
+        # Parse the fields of each line, keeping the first "width".
+        try:
+            xs = np.fromstring(lines.tobytes(),dtype=dtype,sep=' ')
+        except ValueError:
+            # Some line has text that isn't a number after its fields,
+            # like a comment.
+            return by_line(lines,width,dtype)
+        if len(xs) > count * width and len(xs) % count == 0 \
+           and same_fields(lines,len(xs) // count):
+            # Every line has the same extra fields, like the colors
+            # of "v x y z r g b" lines, so just drop them.
+            xs = xs.reshape(count,-1)[:,:width]
+        elif len(xs) != count * width:
+            # Some lines have extra (or missing) fields.
+            xs = by_line(lines,width,dtype)
+        return xs.reshape(-1,width)
+
+    def by_line(lines,width,dtype):
+        # Parse the first "width" fields of each line, line by line.
+        rows = [line.split()[:width]
+                for line in lines.tobytes().split(b'\n')[:-1]]
+        if any(len(row) != width for row in rows):
+            raise ValueError('too few fields on a .obj line')
+        return np.array([[dtype(x) for x in row] for row in rows],
+                        dtype=dtype).reshape(-1,width)
+
+    def same_fields(lines,fields):
+        # Whether every line has the given number of fields, counting
+        # the starts of fields, the bytes that aren't spaces following
+        # those that are, before each line's end.
+        space = (lines == SPACE) | (lines == NEWLINE)
+        starts = np.flatnonzero(~space[1:] & space[:-1]) + 1
+        if len(lines) > 0 and not space[0]:
+            starts = np.concatenate([[0],starts])
+        ends = np.flatnonzero(lines == NEWLINE)
+        return (np.searchsorted(starts,ends)
+                == fields * np.arange(1,len(ends) + 1)).all()
+
+    positions = numbers(gather(is_v,1),is_v.sum(),3,np.float64)
+    normals = numbers(gather(is_vn,2),is_vn.sum(),3,np.float64)
+
+    # Keep only the vertex index of each v/vt/vn triplet by dropping
+    # every byte from a field's first slash up to its end.
+    faces = gather(is_f,1)
+    seps = np.flatnonzero((faces == SPACE) | (faces == NEWLINE))
+    slashes = np.flatnonzero(faces == SLASH)
+    if len(slashes) > 0:
+        stops = seps[np.searchsorted(seps,slashes)]
+        first = np.ones(len(slashes),dtype=bool)
+        first[1:] = stops[1:] != stops[:-1]
+        bounds = np.stack([slashes[first],stops[first]],axis=1).ravel()
+        lengths = np.diff(np.concatenate([[0],bounds,[len(faces)]]))
+        pattern = np.tile([True,False],len(bounds)//2 + 1)[:len(lengths)]
+        faces = faces[np.repeat(pattern,lengths)]
+        seps = np.flatnonzero((faces == SPACE) | (faces == NEWLINE))
+
+    # Count the fields of each face line.  Every line starts with
+    # the space that followed its keyword, so each field begins
+    # right after a separator.
+    fields = seps[:-1][np.diff(seps) > 1] + 1
+    line_ends = np.flatnonzero(faces == NEWLINE)
+    n = np.bincount(np.searchsorted(line_ends,fields),
+                    minlength=len(line_ends))
+    refs = np.fromstring(faces.tobytes(),dtype=np.int64,sep=' ') \
+           if len(fields) > 0 else np.zeros(0,dtype=np.int64)
+    if len(refs) != len(fields):
+        raise ValueError('malformed vertex index on a .obj face line')
+
+    # Resolve each reference to a 0-based index within the file.
+    # Negative ones count back from the last vertex read so far.
+    negative = refs < 0
+    if negative.any():
+        seen = vertex_base + np.cumsum(is_v)[is_f]
+        refs = np.where(negative, refs + np.repeat(seen,n), refs - 1)
+    else:
+        negative = None
+        refs = refs - 1
+
+    # Split each face into a fan of triangles around its first corner.
+    fan_sizes = np.maximum(n - 2,0)
+    corner = np.repeat(np.cumsum(n) - n, fan_sizes)
+    spoke = np.arange(fan_sizes.sum()) \
+            - np.repeat(np.cumsum(fan_sizes) - fan_sizes, fan_sizes) + 1
+    triangles = np.empty((len(corner),3),dtype=np.int32)
+    triangles[:,0] = refs[corner]
+    triangles[:,1] = refs[corner + spoke]
+    triangles[:,2] = refs[corner + spoke + 1]
+
+    relative = None
+    if negative is not None:
+        relative = np.stack([negative[corner],negative[corner + spoke],
+                             negative[corner + spoke + 1]],axis=1)
+    return (positions, normals, triangles, relative)
@@ -12,13 +12,16 @@
 from constants import EPSILON
 from geometry import vector
 from math import sin, cos, sqrt, acos, pi
-from OpenGL.GL import *
+import numpy as np
 
 #
 # Description of quaternion objects and their methods.
 #
 class quat:
 
+    # (no per-instance dictionary, just the scalar and vector parts)
+    __slots__ = ('re','iv')
+
     def __init__(self,real,imagv):
         """ Constructs a new quat instance from the following:
               re: the scalar value of the quaternion
@@ -65,19 +68,45 @@ class quat:
 
     def glRotate(self):
         """ Issues a glRotatef using the rotation of self. """
+        # (imported here so that quat can be used without OpenGL)
+        from OpenGL.GL import glRotatef
         theta,axis = self.as_rotation()
         glRotatef(theta*180.0/pi,axis[0],axis[1],axis[2])
 
     def as_matrix(self):
         """ Returns a column major 3x3 rotation matrix for self. """
-        u = self*quat(0.0,vector(1.0,0.0,0.0))/self
-        v = self*quat(0.0,vector(0.0,1.0,0.0))/self
-        w = self*quat(0.0,vector(0.0,0.0,1.0))/self
-        return [u.vector(),v.vector(),w.vector()]
+        m = self.matrix()
+        return [vector.with_components(m[:,j].tolist()) for j in range(3)]
+
+    def matrix(self):
+        """ Returns the 3x3 rotation matrix for self, as a NumPy array,
+            worked out in closed form.  It rotates column vectors, so
+            its columns are the rotated x, y, and z axes.
+        """
+        w = self.re
+        x, y, z = self.iv.dx, self.iv.dy, self.iv.dz
+        s = 2.0 / (w*w + x*x + y*y + z*z)
+        return np.array([[1.0 - s*(y*y + z*z), s*(x*y - w*z), s*(x*z + w*y)],
+                         [s*(x*y + w*z), 1.0 - s*(x*x + z*z), s*(y*z - w*x)],
+                         [s*(x*z - w*y), s*(y*z + w*x), 1.0 - s*(x*x + y*y)]])
+
+    def as_gl_matrix(self):
+        """ Returns the 4x4 matrix for the rotation of self, in the
+            column major float32 layout wanted by glUniformMatrix4fv.
+        """
+        m = np.identity(4,dtype=np.float32)
+        m[:3,:3] = self.matrix().T
+        return m
 
     def rotate(self,v):
         """ Returns v rotated according to the rotation for self. """
-        return (self*quat(0.0,v)/self).vector()
+        return vector.with_components(self.matrix().dot(v.components()).tolist())
+
+    def rotate_all(self,vs):
+        """ Returns the rows of the n x 3 array vs, each rotated
+            according to the rotation for self.
+        """
+        return np.asarray(vs).dot(self.matrix().T)
 
     def plus(self,other):
         """ Computes the sum of two quat objects, self and other. """
@@ -183,4 +212,12 @@ class quat:
 
     def __getitem__(self,i):
         """ Defines q[i] """
+        if i == 0:
+            return self.re
+        if i == 1:
+            return self.iv.dx
+        if i == 2:
+            return self.iv.dy
+        if i == 3:
+            return self.iv.dz
         return self.components()[i]
@@ -0,0 +1,293 @@
+#
+# render.py
+#
+# A headless software renderer for scenes, for machines with no GPU
+# or display.  It draws the buffers given by scene.compile the way
+# object-view.py does, seen through the trackball and lit by the
+# flashlight, but rasterizes them with NumPy into an image array:
+#
+#   * the vertices are rotated by the trackball and projected with
+#     the same orthographic projection object-view sets up
+#   * each triangle is broken into fragments at the centers of the
+#     pixels in its bounding box, many triangles' worth at a time,
+#     and those inside the triangle and between the near and far
+#     planes are kept
+#   * a z-buffer keeps the nearest fragment of each pixel, the
+#     earliest triangle's on ties, just as GL_LESS does
+#   * the kept fragments are shaded with the Phong model of
+#     shaders/fs-phong-interp.c
+#
+# Frames can be written out as PNG or PPM files.  Run as a program,
+#
+#   python3 render.py <filename.obj> [<image> [<frames> [<width> <height>]]]
+#
+# it renders the given number of frames of the object turning, writes
+# the first to the given .png or .ppm file, and reports the frames
+# per second.
+#
+
+import struct
+import sys
+import time
+import zlib
+from math import pi
+import numpy as np
+from geometry import vector
+from quat import quat
+
+# Most fragments tested at once, which bounds the working memory.
+BATCH_SIZE = 1 << 20
+
+# The constants of the fragment shader.
+GLOSS = 0.5
+SHININESS = 10.0
+LIGHT_C = np.array([0.75, 0.7, 0.8])
+AMBIENT_C = np.array([0.5, 0.6, 0.55])
+
+#
+# render(buffers,trackball,flashlight,width=512,height=512,radius=1.0):
+#
+# Renders the scene given by the buffers from scene.compile, either
+# (vertices, normals, colors) or (vertices, normals, colors, indices),
+# as object-view would draw it with the given trackball and
+# flashlight quaternions and the given viewing radius.  Gives back
+# the image as a height x width x 3 array of bytes, top row first.
+#
+def render(buffers,trackball,flashlight,width=512,height=512,radius=1.0):
+    vertices = np.asarray(buffers[0],dtype=np.float64).reshape(-1,3)
+    normals = np.asarray(buffers[1],dtype=np.float64).reshape(-1,3)
+    colors = np.asarray(buffers[2],dtype=np.float64).reshape(-1,3)
+    if len(buffers) > 3:
+        triangles = np.asarray(buffers[3],dtype=np.int64).reshape(-1,3)
+    else:
+        triangles = np.arange(len(vertices)).reshape(-1,3)
+
+    # Where the shaders' eye and light go, as in object-view's draw.
+    rotation = trackball.matrix()
+    eye = rotation[2]
+    light = 2.0*radius*flashlight.matrix()[:,2]
+
+    # Rotate and project the vertices: x and y to pixel coordinates,
+    # z to a depth between 0 (near) and 1 (far).
+    if width > height:
+        half_w, half_h = width/height*radius, radius
+    else:
+        half_w, half_h = radius, height/width*radius
+    view = vertices.dot(rotation.T)
+    sx = (view[:,0] + half_w) / (2.0*half_w) * width
+    sy = (half_h - view[:,1]) / (2.0*half_h) * height
+    depth = (1.0 - view[:,2]/radius) * 0.5
+
+    # The pixels whose centers lie within each triangle's bounds.
+    tx = sx[triangles]
+    ty = sy[triangles]
+    x0 = np.maximum(np.ceil(tx.min(axis=1) - 0.5),0).astype(np.int64)
+    x1 = np.minimum(np.floor(tx.max(axis=1) - 0.5),width-1).astype(np.int64)
+    y0 = np.maximum(np.ceil(ty.min(axis=1) - 0.5),0).astype(np.int64)
+    y1 = np.minimum(np.floor(ty.max(axis=1) - 0.5),height-1).astype(np.int64)
+    across = np.maximum(x1 - x0 + 1,0)
+    counts = across * np.maximum(y1 - y0 + 1,0)
+    area = (tx[:,1]-tx[:,0])*(ty[:,2]-ty[:,0]) \
+           - (tx[:,2]-tx[:,0])*(ty[:,1]-ty[:,0])
+    counts[area == 0.0] = 0
+
+    # The first two barycentric coordinates and the depth vary across
+    # each triangle as planes a*x + b*y + c, with these coefficients.
+    with np.errstate(divide='ignore',invalid='ignore'):
+        planes = np.empty((len(triangles),3,3))
+        for i,(j,k) in enumerate([(1,2),(2,0)]):
+            planes[:,i,0] = (ty[:,j] - ty[:,k]) / area
+            planes[:,i,1] = (tx[:,k] - tx[:,j]) / area
+            planes[:,i,2] = (tx[:,j]*ty[:,k] - tx[:,k]*ty[:,j]) / area
+        d = depth[triangles]
+        planes[:,2] = (d[:,0] - d[:,2])[:,None] * planes[:,0] \
+                      + (d[:,1] - d[:,2])[:,None] * planes[:,1]
+        planes[:,2,2] += d[:,2]
+
+    # The z-buffer, with the triangle and barycentric coordinates of
+    # the fragment kept at each pixel.
+    zbuffer = np.full(width*height,np.inf)
+    winner = np.full(width*height,-1,dtype=np.int64)
+    weights = np.zeros((width*height,3))
+
+    ends = np.cumsum(counts)
+    first = 0
+    while first < len(triangles):
+        last = max(int(np.searchsorted(ends,ends[first] - counts[first]
+                                       + BATCH_SIZE,side='right')),first+1)
+        rasterize(np.arange(first,last),counts[first:last],
+                  x0,y0,across,planes,width,zbuffer,winner,weights)
+        first = last
+
+    # Shade the pixels that were drawn, interpolating the vertex
+    # attributes across each triangle.
+    image = np.zeros((width*height,3))
+    drawn = np.flatnonzero(winner >= 0)
+    corners = triangles[winner[drawn]]
+    w = weights[drawn][:,:,None]
+    P = (vertices[corners] * w).sum(axis=1)
+    n = (normals[corners] * w).sum(axis=1)
+    material_c = (colors[corners] * w).sum(axis=1)
+    image[drawn] = phong(P,n,material_c,eye,light)
+
+    image = np.round(np.clip(image,0.0,1.0) * 255.0).astype(np.uint8)
+    return image.reshape(height,width,3)
+
+#
+# rasterize(ids,counts,x0,y0,across,planes,width,zbuffer,winner,weights):
+#
+# Tests the fragments of the triangles with the given ids, which
+# have the given numbers of pixels in their bounds, and writes those
+# that pass the depth test into the z-buffer arrays.
+#
+def rasterize(ids,counts,x0,y0,across,planes,width,zbuffer,winner,weights):
+    total = int(counts.sum())
+    if total == 0:
+        return
+
+    # Lay out each triangle's pixels, row by row within its bounds.
+    which = np.repeat(ids,counts)
+    k = np.arange(total) - np.repeat(np.cumsum(counts) - counts,counts)
+    px = x0[which] + k % across[which]
+    py = y0[which] + k // across[which]
+    cx = px + 0.5
+    cy = py + 0.5
+
+    # Find each pixel center's barycentric coordinates and depth.
+    p = planes[which]
+    b0 = p[:,0,0]*cx + p[:,0,1]*cy + p[:,0,2]
+    b1 = p[:,1,0]*cx + p[:,1,1]*cy + p[:,1,2]
+    b2 = 1.0 - b0 - b1
+    z = p[:,2,0]*cx + p[:,2,1]*cy + p[:,2,2]
+    inside = (b0 >= 0.0) & (b1 >= 0.0) & (b2 >= 0.0) \
+             & (z >= 0.0) & (z <= 1.0)
+
+    which = which[inside]
+    pixel = (py * width + px)[inside]
+    z = z[inside]
+    b = np.stack([b0[inside],b1[inside],b2[inside]],axis=1)
+
+    # Keep the nearest of each pixel's fragments, if it's nearer than
+    # what's already there, and the earliest of those on ties (the
+    # fragments are in triangle order).
+    nearest = zbuffer.copy()
+    np.minimum.at(nearest,pixel,z)
+    tied = np.flatnonzero((z == nearest[pixel]) & (z < zbuffer[pixel]))
+    earliest = np.full(len(zbuffer),len(z))
+    np.minimum.at(earliest,pixel[tied],tied)
+    chosen = earliest[earliest < len(z)]
+    pixel = pixel[chosen]
+    zbuffer[pixel] = z[chosen]
+    winner[pixel] = which[chosen]
+    weights[pixel] = b[chosen]
+
+#
+# phong(P,n,material_c,eye,light):
+#
+# The colors given by shaders/fs-phong-interp.c for fragments with
+# the given n x 3 arrays of positions, normals, and material colors.
+#
+def phong(P,n,material_c,eye,light):
+    l = normalize(light - P)
+    e = normalize(eye - P)
+    l_dot_n = (l * n).sum(axis=1)[:,None]
+    r = -l + 2.0 * l_dot_n * n
+    lit = np.maximum(l_dot_n,0.0)
+
+    ambient = AMBIENT_C * material_c
+    diffuse = LIGHT_C * material_c * lit
+    specular = LIGHT_C * GLOSS * lit \
+               * np.maximum((e * r).sum(axis=1),0.0)[:,None] ** SHININESS
+    return ambient + diffuse + specular
+
+#
+# normalize(vs):
+#
+# The rows of vs scaled to unit length, as GLSL's normalize does.
+#
+def normalize(vs):
+    return vs / np.sqrt((vs * vs).sum(axis=1))[:,None]
+
+#
+# write_ppm(filename,image):
+#
+# Writes a height x width x 3 array of bytes as a binary PPM file.
+#
+def write_ppm(filename,image):
+    height, width = image.shape[:2]
+    with open(filename,'wb') as ppm_file:
+        ppm_file.write(b'P6\n%d %d\n255\n' % (width,height))
+        ppm_file.write(np.ascontiguousarray(image,dtype=np.uint8).tobytes())
+
+#
+# write_png(filename,image):
+#
+# Writes a height x width x 3 array of bytes as a PNG file.
+#
+def write_png(filename,image):
+    height, width = image.shape[:2]
+
+    def chunk(kind,data):
+        return struct.pack('>I',len(data)) + kind + data \
+               + struct.pack('>I',zlib.crc32(kind + data) & 0xffffffff)
+
+    # Each row starts with a 0 byte, for no filtering.
+    rows = np.zeros((height,1 + 3*width),dtype=np.uint8)
+    rows[:,1:] = image.reshape(height,3*width)
+    with open(filename,'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n')
+        png_file.write(chunk(b'IHDR',struct.pack('>IIBBBBB',width,height,
+                                                 8,2,0,0,0)))
+        png_file.write(chunk(b'IDAT',zlib.compress(rows.tobytes())))
+        png_file.write(chunk(b'IEND',b''))
+
+#
+# write_image(filename,image):
+#
+# Writes an image as a PNG or a PPM file, going by its extension.
+#
+def write_image(filename,image):
+    if filename.lower().endswith('.ppm'):
+        write_ppm(filename,image)
+    else:
+        write_png(filename,image)
+
+
+def main(argc, argv):
+    """ Render frames of an .obj file and report the frame rate. """
+    from scene import scene
+
+    if argc < 2 or argc == 5 or argc > 6:
+        print('usage: python3 render.py <filename.obj> '
+              '[<image> [<frames> [<width> <height>]]]')
+        return 1
+    image_name = argv[2] if argc > 2 else None
+    frames = int(argv[3]) if argc > 3 else 1
+    width, height = (int(argv[4]), int(argv[5])) if argc > 5 else (512, 512)
+    if frames < 1:
+        print('render.py: <frames> must be at least 1')
+        return 1
+
+    start = time.perf_counter()
+    scene.read(argv[1])
+    buffers = scene.compile(indexed=True)
+    print('Read and compiled in %.3f seconds.' % (time.perf_counter()-start))
+
+    # Turn the object a little more each frame, like a trackball drag.
+    flashlight = quat.for_rotation(0.0,vector(1.0,0.0,0.0))
+    start = time.perf_counter()
+    for frame in range(frames):
+        trackball = quat.for_rotation(2.0*pi*frame/frames,
+                                      vector(0.0,1.0,0.0))
+        image = render(buffers,trackball,flashlight,width,height)
+        if frame == 0:
+            first_image = image
+    elapsed = time.perf_counter() - start
+    if image_name is not None:
+        write_image(image_name,first_image)
+
+    print('Rendered %d frames of %dx%d in %.3f seconds: %.2f frames/second.'
+          % (frames,width,height,elapsed,frames/elapsed))
+    return 0
+
+if __name__ == '__main__': sys.exit(main(len(sys.argv),sys.argv))
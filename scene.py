@@ -18,11 +18,61 @@
 #
 #   face: a triangular face on a surface of some object in the 
 #         scene.  It has three border half-edges.  
-
+#
+# The scene's surface itself is stored compactly as arrays in a mesh
+# object (see mesh.py).  Instances of these three classes are just
+# views onto it: each holds the id of the element it stands for, and
+# the mesh it's in.
+#
+# The scene keeps one mesh of its own, scene.mesh, which scene.read
+# adds files to by default, and which the classes' methods work on
+# by default.  Any of them can instead be given a mesh of its own,
+# e.g. one made by scene.load.  Such meshes share nothing, so they
+# can be loaded, used, and freed independently, in separate threads
+# if need be.
+
+from concurrent.futures import ProcessPoolExecutor
 from constants import *
-from geometry import vector, point, ORIGIN
-from math import sqrt
-import sys
+from geometry import vector, point
+import instrument
+from mesh import mesh, rebox_transform, weld_map, unit, cross
+import numpy as np
+import meshcache
+import objfile
+import os
+from smoother import smoother
+
+#
+# class elements
+#
+# A list-like view of all the vertices, edges, or faces of a mesh,
+# or of the scene's mesh if none is given, for use as the "instances"
+# of each class.  Its items are made as they are looked up.
+#
+class elements:
+
+    def __init__(self,kind,mesh=None):
+        self.kind = kind
+        self.mesh = mesh
+
+    def __len__(self):
+        return self.kind.count(self.mesh)
+
+    def __getitem__(self,i):
+        M = scene.mesh if self.mesh is None else self.mesh
+        if isinstance(i,slice):
+            return [self.kind(j,M) for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('no '+self.kind.__name__+' with that id')
+        return self.kind(i,M)
+
+    def __iter__(self):
+        M = scene.mesh if self.mesh is None else self.mesh
+        for i in range(len(self)):
+            yield self.kind(i,M)
 
 #
 # class fan
@@ -44,6 +94,8 @@ class fan:
     #
     # Creates a fan object for the given vertex,
     #
+    __slots__ = ('vertex','which')
+
     def __init__(self,vertex):
         self.vertex = vertex
         self.which = None
@@ -99,85 +151,132 @@ class vertex:
     # vertex class attributes:
     #
     # * instances: a list of all instances of class vertex
+    #              (set below, once the class is defined)
+    #
+    instances = None
+
+    # (a view keeps no dictionary, just its id and mesh)
+    __slots__ = ('id','mesh')
+
+    @classmethod
+    #
+    # vertex.count(mesh=None):
     #
-    instances = []
+    # Returns the number of vertices in the mesh (or the scene).
+    #
+    def count(cls,mesh=None):
+        return (scene.mesh if mesh is None else mesh).vertex_count()
 
     @classmethod
     #
-    # vertex.with_id(id):
+    # vertex.with_id(id,mesh=None):
     #
     # Returns the instance with the given integer id.
     #
-    def with_id(cls,id):
-        return cls.instances[id]
+    def with_id(cls,id,mesh=None):
+        return cls.all_instances(mesh)[id]
 
     @classmethod
     #
-    # vertex.all_instances():
+    # vertex.all_instances(mesh=None):
     #
-    # Returns all the instances of class vertex as a list.
+    # Returns all the instances of class vertex as a list, those of
+    # the given mesh or of the scene.
     #
-    def all_instances(cls):
-        return cls.instances
+    def all_instances(cls,mesh=None):
+        if mesh is None:
+            return cls.instances
+        return elements(cls,mesh)
 
     @classmethod
-    # vertex.add(p):
+    # vertex.add(p,mesh=None):
     #
     # Creates and returns a new vertex instance at position p.
     #
-    def add(cls,position):
-        return vertex(position)
+    def add(cls,position,mesh=None):
+        M = scene.mesh if mesh is None else mesh
+        return vertex(M.add_vertices(position.components()),M)
 
     @classmethod
-    # vertex.set_first_edge():
+    # vertex.set_first_edge(mesh=None):
     #
     # Makes sure that the recorded out edge of each vertex
     # is one that is clockwise from all the others.
     #
-    def set_first_edges(cls):
-        for V in cls.all_instances():
-            V.set_first_edge()
+    def set_first_edges(cls,mesh=None):
+        with instrument.stage('fans'):
+            (scene.mesh if mesh is None else mesh).set_first_edges()
 
             
     @classmethod
-    # vertex.smooth_normals():
-    #
-    # Computes a new vertex normal for all the vertices.  Each computes a
-    # a weighted average of its normal with the normal of its neighboring
-    # vertices.
-    #
-    def smooth_normals(cls):
-        #
-        # Compute 
-        #
-        #     n' := d n + sum n_i
-        #
-        # for each neighbor normal n_i.  Here d is the number of neighbors
-        # (the degree) of the vertex.
-        #
-        for V in cls.instances:
-            n = vector(0.0,0.0,0.0)
-            for e in V.around():
-                n = n + V.normal() + e.vertex(1).normal()
-            V.new_vn = n.unit()
-
-        #
-        # Replace each normal with the one computed above.
-        #
-        for V in cls.instances:
-            V.set_normal(V.new_vn)
-        
-    
-    # vertex(P):
+    # vertex.smooth_normals(vertices,passes,damping,crease,mesh):
+    #
+    # Computes a new vertex normal for all the vertices (or just
+    # those given).  Each computes a weighted average of its normal
+    # with the normal of its neighboring vertices.
+    #
+    # By default this makes one pass, computing
+    #
+    #     n' := d n + sum n_i
+    #
+    # for each neighbor normal n_i.  Here d is the number of neighbors
+    # (the degree) of the vertex.  See class smoother for the number
+    # of passes, the damping weight, and the crease angle.  The
+    # vertices are those of the given mesh, or of the scene, and can
+    # be given as vertex instances or as an array of their ids.
     #
-    # (Creates and) initializes a new vertex object at position P.
+    def smooth_normals(cls,vertices=None,passes=1,damping=0.5,crease=None,
+                       mesh=None):
+        M = scene.mesh if mesh is None else mesh
+        with instrument.stage('smooth'):
+            M.compute_normals()
+            ids = None
+            if isinstance(vertices,np.ndarray):
+                ids = vertices.astype(np.int64)
+            elif vertices is not None:
+                ids = np.array([V.id for V in vertices],dtype=np.int64)
+            M.normals = smoother(M,damping,crease).smooth(M.normals,
+                                                          passes,ids)
+
+    # vertex(id,mesh=None):
+    #
+    # Initializes a view of the vertex with the given id, in the
+    # given mesh or in the scene's.
+    #
+    # Instance attributes:
     #
-    def __init__(self,P):
-        self.position = P
-        self.edge = None
-        self.id = len(vertex.instances)
-        vertex.instances.append(self)
-        self.vn = None
+    #   * id: integer id identifying this vertex
+    #   * mesh: the mesh that stores this vertex
+    #
+    # Its position, out edge, and normal vn are looked up in (and
+    # changed within) the mesh.
+    #
+    def __init__(self,id,mesh=None):
+        self.id = id
+        self.mesh = scene.mesh if mesh is None else mesh
+
+    @property
+    def position(self):
+        return point.with_components(self.mesh.positions[self.id].tolist())
+
+    @position.setter
+    def position(self,P):
+        self.mesh.positions[self.id] = P.components()
+        self.mesh.moved()
+
+    @property
+    def edge(self):
+        e = int(self.mesh.out[self.id])
+        return edge(e,self.mesh) if e >= 0 else None
+
+    @edge.setter
+    def edge(self,e):
+        self.mesh.out[self.id] = e.id if e != None else -1
+        self.mesh.relinked()
+
+    @property
+    def vn(self):
+        return vector.with_components(self.mesh.normals[self.id].tolist())
 
     #
     # self.set_normal(vn):
@@ -185,7 +284,7 @@ class vertex:
     # Sets or changes the normal attached to this vertex.
     #
     def set_normal(self, vn):
-        self.vn = vn
+        self.mesh.normals[self.id] = vn.components()
 
     #
     # self.normal():
@@ -223,11 +322,23 @@ class vertex:
     #   for e in V.around():
     #      ... do something with e ...
     #
-    # See class "fan" for details, and method "normal" for a 
-    # concrete example of its use.
+    # The edges are those class "fan" would walk, looked up in the
+    # mesh's adjacency indexes.  See method "normal" for a concrete
+    # example of its use.
     #
     def around(self):
-        return fan(self)
+        M = self.mesh
+        return (edge(e,M) for e in M.adjacency().fan(self.id).tolist())
+
+    # self.neighbors()
+    #
+    # Returns a list of the vertices that share an edge with this
+    # vertex, in order of their ids.
+    #
+    def neighbors(self):
+        M = self.mesh
+        return [vertex(v,M)
+                for v in M.adjacency().vertex_neighbors(self.id).tolist()]
 
     # self.set_first_edge()
     #
@@ -248,6 +359,17 @@ class vertex:
         # Otherwise, let's have this be the first out edge.
         self.edge = e
 
+    def __eq__(self,other):
+        return isinstance(other,vertex) and self.id == other.id \
+               and self.mesh is other.mesh
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((vertex,self.id))
+
+vertex.instances = elements(vertex)
 
 #
 # class edge: 
@@ -262,23 +384,42 @@ class vertex:
 #
 class edge:
 
-    # vertex class attributes:
+    # edge class attributes:
     #
-    # * dictionary: a mapping from vertex id pairs to edge instances
+    # * instances: a list of all instances of class edge
     #
-    dictionary = { }
+    # (The mapping from vertex id pairs to edge ids is kept by each
+    # mesh, as its edge_map.)
+    #
+    instances = None
+
+    # (a view keeps no dictionary, just its id and mesh)
+    __slots__ = ('id','mesh')
 
     @classmethod
     #
-    # edge.between_ids(iv1,iv2):
+    # edge.count(mesh=None):
+    #
+    # Returns the number of half-edges in the mesh (or the scene).
+    #
+    def count(cls,mesh=None):
+        return (scene.mesh if mesh is None else mesh).edge_count()
+
+    @classmethod
+    #
+    # edge.between_ids(iv1,iv2,mesh=None):
     # 
     # Return whether or not an edge between V1 and V2 had been 
     # constructed, where V1.id = iv1 and V2.id = iv2.  Returns
     # that edge if so, and None if not.
     #
-    def between_ids(cls,iv1,iv2):
-        if (iv1,iv2) in cls.dictionary:
-            return cls.dictionary[(iv1,iv2)]
+    def between_ids(cls,iv1,iv2,mesh=None):
+        if instrument.enabled:
+            instrument.count('edge lookups')
+        M = scene.mesh if mesh is None else mesh
+        cls.map_edges(M.edge_count(),M)
+        if (iv1,iv2) in M.edge_map:
+            return edge(M.edge_map[(iv1,iv2)],M)
         else:
             return None
 
@@ -286,44 +427,98 @@ class edge:
     #
     # register(e,iv1,iv2):
     #
-    # Associate edge e with the vertex id pair (iv1,iv2).
+    # Associate edge e with the vertex id pair (iv1,iv2), in the
+    # mesh of e.
     #
     def register(cls,e,iv1,iv2):
-        cls.dictionary[(iv1,iv2)] = e
+        if instrument.enabled:
+            instrument.count('edges registered')
+        e.mesh.edge_map[(iv1,iv2)] = e.id
 
+    @classmethod
+    #
+    # edge.map_edges(last,mesh=None):
+    #
+    # Enters the half-edges of the mesh (or the scene) that are
+    # missing from its edge map, up to the one with id last, in
+    # order.  Their twins are already known, so they're left as is.
+    #
+    def map_edges(cls,last,mesh=None):
+        M = scene.mesh if mesh is None else mesh
+        first = M.mapped
+        if first >= last:
+            return
+        sources = M.source[first:last].tolist()
+        targets = M.source[M.next[first:last]].tolist()
+        M.edge_map.update(zip(zip(sources,targets),range(first,last)))
+        M.mapped = last
+
+    @classmethod
+    #
+    # edge.register_all(first,mesh=None):
+    #
+    # Registers each of the mesh's (or the scene's) half-edges,
+    # starting with the one with id first, in order.  Each gets
+    # linked to its twin, if that twin's been registered.  This is
+    # done all at once by the mesh's link_twins; the edge map is left
+    # to fill in when an edge is looked up.
+    #
+    # Returns the arrays of the ids of badly oriented faces and of
+    # non-manifold half-edges found.
+    #
+    def register_all(cls,first,mesh=None):
+        with instrument.stage('register'):
+            M = scene.mesh if mesh is None else mesh
+            bad, non_manifold = M.link_twins(first)
+            if len(bad) > 0:
+                print('Bad orientation for %d faces, from face %d'
+                      % (len(bad),bad[0]))
+            instrument.count('edges registered',M.edge_count() - first)
+            instrument.count('bad orientations',len(bad))
+            instrument.count('non-manifold edges',len(non_manifold))
+        return (bad, non_manifold)
 
     #
-    # edge(V1,V2,f):
+    # edge(id,mesh=None):
+    #
+    # Initializes a view of the half-edge with the given id, in the
+    # given mesh or in the scene's.
     #
-    # Create an edge from V1 to V2 bordering face f.
+    # edge instance attributes:
     #
-    # vertex instance attributes:
+    #  * id: integer id identifying this edge
+    #  * mesh: the mesh that stores this edge
     #
-    #  * source: first vertex of the vertex pair
-    #  * face: left face bordered by this edge
-    #  * next: next edge bordering the same face
-    #  * twin: the twin edge to this edge
+    # Its source (first vertex of the vertex pair), face (left face
+    # bordered by this edge), next (next edge bordering the same
+    # face), and twin (the twin edge to this edge) are looked up in
+    # the mesh.
     #
-    def __init__(self,V1,V2,f):
+    def __init__(self,id,mesh=None):
+        self.id = id
+        self.mesh = scene.mesh if mesh is None else mesh
 
-        self.source = V1  # Set the source vertex.
-        V1.edge = self    # Register edge with the source vertex.
-        self.face = f     # Set the face.
+    @property
+    def source(self):
+        return vertex(int(self.mesh.source[self.id]),self.mesh)
 
-        self.next = None  # Will be set later.
+    @property
+    def face(self):
+        return face(int(self.mesh.face[self.id]),self.mesh)
 
-        # Register this edge.
-        iv1 = V1.id
-        iv2 = V2.id
-        if edge.between_ids(iv1,iv2):
-            print('Bad orientation for face ',f)
-        edge.register(self,iv1,iv2)
+    @property
+    def next(self):
+        return edge(int(self.mesh.next[self.id]),self.mesh)
 
-        # Check if this edge has a twin yet.
-        self.twin = edge.between_ids(iv2,iv1)
-        if self.twin:
-            # Update the twin info of its twin.
-            self.twin.twin = self
+    @property
+    def twin(self):
+        e = int(self.mesh.twin[self.id])
+        return edge(e,self.mesh) if e >= 0 else None
+
+    @twin.setter
+    def twin(self,e):
+        self.mesh.twin[self.id] = e.id if e != None else -1
+        self.mesh.relinked()
     
     # 
     # self.vertex(i):
@@ -359,6 +554,19 @@ class edge:
 
     def __str__(self):
         return str(self.vertex(0).id)+':'+str(self.vertex(1).id)
+
+    def __eq__(self,other):
+        return isinstance(other,edge) and self.id == other.id \
+               and self.mesh is other.mesh
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((edge,self.id))
+
+edge.instances = elements(edge)
+
 #
 # class face: 
 #
@@ -370,59 +578,83 @@ class face:
     # Class attributes:
     #
     #  * instances: list of all face instances
+    #               (set below, once the class is defined)
+    #
+    instances = None
+
+    # (a view keeps no dictionary, just its id and mesh)
+    __slots__ = ('id','mesh')
+
+    @classmethod
+    #
+    # face.count(mesh=None):
     #
-    instances = []
+    # Returns the number of faces in the mesh (or the scene).
+    #
+    def count(cls,mesh=None):
+        return (scene.mesh if mesh is None else mesh).face_count()
 
     @classmethod
-    # face.of_id(id):
+    # face.of_id(id,mesh=None):
     #
     # Get the face with the given integer id.
     #
-    def of_id(cls,id):
-        return cls.instances[id]
+    def of_id(cls,id,mesh=None):
+        return cls.all_instances(mesh)[id]
 
     @classmethod
-    # face.all_instances():
+    # face.all_instances(mesh=None):
     #
-    # Returns the list of all face instances.
+    # Returns the list of all face instances, those of the given
+    # mesh or of the scene.
     #
-    def all_instances(cls):
-        return cls.instances
+    def all_instances(cls,mesh=None):
+        if mesh is None:
+            return cls.instances
+        return elements(cls,mesh)
 
     @classmethod
     # face.add(V1,V2,V3):
     #
     # Creates and returns a new face instance with vertex corners
-    # V1, V2, and V3.
+    # V1, V2, and V3, in their mesh.
     #
     def add(self,V1,V2,V3):
-        return face(V1,V2,V3)
+        M = V1.mesh
+        first = M.add_triangles([[V1.id,V2.id,V3.id]])
+        edge.register_all(first,M)
+        return face(first // 3,M)
 
     #
-    # face(V1,V2,V3):
+    # face(id,mesh=None):
     #
-    # Create and initialize a new face instance.
+    # Initializes a view of the face with the given id, in the given
+    # mesh or in the scene's.
     #
     # Instance attributes:
     #
-    #   * side: one of the three directed edges
-    #   * fn: face normal
-    #   * id: integer id identifying this vertex
+    #   * id: integer id identifying this face
+    #   * mesh: the mesh that stores this face
     #
-    def __init__(self,V1,V2,V3):
+    # Its side (one of the three directed edges) and face normal fn
+    # are looked up in the mesh.
+    #
+    def __init__(self,id,mesh=None):
+        self.id = id
+        self.mesh = scene.mesh if mesh is None else mesh
 
-        e1 = edge(V1,V2,self)
-        e2 = edge(V2,V3,self)
-        e3 = edge(V3,V1,self)
+    @property
+    def side(self):
+        return edge(3*self.id,self.mesh)
 
-        e1.next = e2
-        e2.next = e3
-        e3.next = e1
-        
-        self.side = e1
-        self.id = len(face.instances)
-        face.instances.append(self)
-        self.fn = None
+    @property
+    def fn(self):
+        return vector.with_components(
+            self.mesh.face_normals[self.id].tolist())
+
+    @fn.setter
+    def fn(self,n):
+        self.mesh.face_normals[self.id] = n.components()
 
     #
     # self.normal():
@@ -464,6 +696,17 @@ class face:
         else:
             return None
 
+    #
+    # self.neighbors():
+    #
+    # Returns a list of the faces that share an edge with this face,
+    # in order of their ids.
+    #
+    def neighbors(self):
+        M = self.mesh
+        return [face(f,M)
+                for f in M.adjacency().face_neighbors(self.id).tolist()]
+
     def intersect_ray(self,R,d):
         Q1 = self.vertex(0).position
         Q2 = self.vertex(1).position
@@ -515,6 +758,18 @@ class face:
 
         return [[a1,a2,a3],scale,dist]
 
+    def __eq__(self,other):
+        return isinstance(other,face) and self.id == other.id \
+               and self.mesh is other.mesh
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((face,self.id))
+
+face.instances = elements(face)
+
 #
 # class scene:
 #
@@ -524,103 +779,457 @@ class face:
 #
 class scene:
 
+    # scene class attributes:
+    #
+    # * mesh: the arrays storing all the vertices, edges, and faces
+    #         of the scene, unless others are given
+    #
+    mesh = mesh()
+
     @classmethod
-    def read(cls,filename):
+    # scene.read(filename,cache=True,mesh=None,processes=1,weld=None):
+    #
+    # Reads the .obj file with the given name, adding its vertices
+    # and faces to the given mesh, or to the scene's.  Uses (and
+    # otherwise saves) the file's cache, if cache is set.  Returns
+    # the mesh.  A large file can be parsed by a pool of worker
+    # processes, each taking a share of its lines (see objfile.py).
+    #
+    # If a weld tolerance is given, the file's vertices that lie
+    # within it of one another are merged before its faces are
+    # built (see scene.weld), so that faces split apart along seams
+    # are joined up.
+    #
+    # The stages of a read are timed by the instrument module, when
+    # it's turned on.
+    #
+    def read(cls,filename,cache=True,mesh=None,processes=1,weld=None):
+        M = cls.mesh if mesh is None else mesh
+        with instrument.stage('read'):
+            cls.read_stages(filename,cache,M,processes,weld)
+        return M
 
-        obj_file = open(filename,'r')
+    @classmethod
+    # scene.load(filename,cache=True,processes=1,weld=None):
+    #
+    # Reads the .obj file with the given name into a new mesh of its
+    # own, apart from the scene, and returns that mesh.
+    #
+    def load(cls,filename,cache=True,processes=1,weld=None):
+        return cls.read(filename,cache,mesh(),processes,weld)
+
+    @classmethod
+    # scene.read_all(filenames,processes=None,mesh=None,weld=None):
+    #
+    # Reads the .obj files with the given names, adding them to the
+    # given mesh, or to the scene's, as though they were one file.
+    # The files are parsed in parallel, by a pool of the given number
+    # of worker processes (by default, one for each core), and their
+    # arrays are merged in order, each file's vertex ids offset by
+    # the number of vertices before it.  Their normals are then
+    # computed and smoothed, and the mesh reboxed, just once.  If a
+    # weld tolerance is given, the merged vertices are welded, which
+    # also joins up the files' faces where they meet.  Returns the
+    # mesh.
+    #
+    def read_all(cls,filenames,processes=None,mesh=None,weld=None):
+        M = cls.mesh if mesh is None else mesh
+        if not filenames:
+            return M
+        with instrument.stage('read all'):
+            instrument.count('files read',len(filenames))
+            with instrument.stage('parse'):
+                parsed = cls.parse_all(filenames,processes)
+
+            # Merge the files' arrays, offsetting their vertex ids.
+            with instrument.stage('merge'):
+                offsets = np.cumsum([0] + [len(p[0]) for p in parsed])
+                positions = np.concatenate([p[0] for p in parsed])
+                normals = np.concatenate([p[1] for p in parsed])
+                triangles = np.concatenate(
+                    [p[2].reshape(-1,3) + offset
+                     for p,offset in zip(parsed,offsets)])
+            if weld is not None:
+                positions, normals, triangles, merged = \
+                    cls.weld(positions,normals,triangles,weld)
+                M.welded += merged
+            cls.build(positions,normals,triangles,M)
+
+            vertex.set_first_edges(M)
+            with instrument.stage('normals'):
+                M.compute_normals()
+            vertex.smooth_normals(mesh=M)
+            scene.rebox(M)
+        return M
+
+    @classmethod
+    # scene.parse_all(filenames,processes=None):
+    #
+    # Parses each of the .obj files with the given names, as
+    # scene.parse does, across a pool of the given number of worker
+    # processes.  Returns the list of their arrays, in order.
+    #
+    def parse_all(cls,filenames,processes=None):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes,len(filenames))
+        if processes <= 1:
+            return [cls.parse_arrays(filename) for filename in filenames]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parsed = list(pool.map(cls.parse_arrays,filenames))
+
+        # (what the workers counted stayed with them)
+        for positions, normals, triangles in parsed:
+            instrument.count('vertices read',len(positions))
+            instrument.count('faces read',len(triangles))
+        return parsed
+
+    @classmethod
+    def read_stages(cls,filename,cache,M,processes,weld=None):
 
         # Record the offset for vertex ID conversion.
-        vertexi = len(vertex.all_instances())   
-
-        # Count the number of vertex normals read.
-        normali = 0                             
-
-        for line in obj_file:
-
-            parts = line[:-1].split()
-            if len(parts) > 0:
-
-                # Read a vertex description line.
-                if parts[0] == 'v': 
-                    x = float(parts[1])
-                    y = float(parts[2])
-                    z = float(parts[3])
-                    P = point(x,y,z)
-                    vertex.add(P)
-
-                # Read a vertex normal description line.
-                elif parts[0] == 'vn': 
-                    dx = float(parts[1])
-                    dy = float(parts[2])
-                    dz = float(parts[3])
-                    vn = vector(dx,dy,dz).unit()
-                    vertex.with_id(vertexi + normali).set_normal(vn)
-                    normali += 1
-
-                # Read a face/fan description line.
-                elif parts[0] == 'f': 
-
-                    #### ADDS AN OFFSET vertexi FROM THE .OBJ INDEX!!! (.OBJ starts at 1) ####
-                    vi_fan = [int(p.split('/')[0]) + vertexi - 1 for p in parts[1:]]
-
-                    vi1 = vi_fan[0]
-                    # add the faces of the fan
-                    for i in range(1,len(vi_fan)-1):
-                        vi2 = vi_fan[i]
-                        vi3 = vi_fan[i+1]
-                        V1 = vertex.with_id(vi1)
-                        V2 = vertex.with_id(vi2)
-                        V3 = vertex.with_id(vi3)
-                        face.add(V1,V2,V3)
+        vertexi = M.vertex_count()
+        instrument.count('files read')
+
+        # Reuse the work of an earlier read of this file, if saved.
+        if cache:
+            with instrument.stage('cache load'):
+                arrays = meshcache.load(filename)
+            # (a cache made with another weld tolerance won't do)
+            if arrays is not None:
+                welded = arrays.get('weld')
+                if (None if welded is None else float(welded[0])) != weld:
+                    arrays = None
+            if arrays is not None:
+                instrument.count('cache hits')
+                cls.restore(arrays,vertexi,M)
+                if weld is not None:
+                    M.welded += int(welded[1])
+                return
+
+        positions, normals, triangles = cls.parse(filename,processes)
+        if weld is not None:
+            positions, normals, triangles, merged = \
+                cls.weld(positions,normals,triangles,weld)
+            M.welded += merged
+        first = cls.build(positions,normals,triangles,M)
 
         # set the vertex fan ordering
-        vertex.set_first_edges()
+        vertex.set_first_edges(M)
 
         # compute the vertex normals, then smooth then out
-        vertex.smooth_normals()
+        with instrument.stage('normals'):
+            M.compute_normals()
+        vertex.smooth_normals(mesh=M)
+
+        # save this file's share of the work for the next read
+        if cache:
+            with instrument.stage('cache save'):
+                twins = M.twin[first:]
+                center, scale = rebox_transform(positions)
+                arrays = {'positions': positions,
+                          'triangles': triangles,
+                          'twins': np.where(twins >= 0, twins - first, -1),
+                          'normals': M.normals[vertexi:],
+                          'rebox': np.append(center,scale)}
+                if weld is not None:
+                    arrays['weld'] = np.array([weld,merged],dtype=np.float64)
+                meshcache.save(filename,arrays)
 
         # rescale and center the points
-        scene.rebox()
+        scene.rebox(M)
 
     @classmethod
-    def rebox(cls):
-        max_dims = point(sys.float_info.min,
-                         sys.float_info.min,
-                         sys.float_info.min)
-        min_dims = point(sys.float_info.max,
-                         sys.float_info.max,
-                         sys.float_info.max)
-        for V in vertex.all_instances():
-            max_dims = max_dims.max(V.position)
-            min_dims = min_dims.min(V.position)
+    # scene.parse(filename,processes=1):
+    #
+    # Parses the .obj file with the given name into arrays of vertex
+    # positions, unit vertex normals (one for each vertex, or zero
+    # where none was given), and triangles of 0-based vertex indices,
+    # using up to the given number of worker processes.
+    #
+    def parse(cls,filename,processes=1):
+        with instrument.stage('parse'):
+            return cls.parse_arrays(filename,processes)
 
-        center = min_dims.combo(0.5,max_dims)
-        span = max_dims - min_dims
-        scale = 1.8*sqrt(2.0)/abs(span)
+    @classmethod
+    def parse_arrays(cls,filename,processes=1):
+        positions, normals, triangles = objfile.read(filename,processes)
+        instrument.count('vertices read',len(positions))
+        instrument.count('faces read',len(triangles))
+
+        # Normalize the vertex normals read.  They go, in order, with
+        # the new vertices.
+        normals = unit(normals)
+        if len(normals) > len(positions):
+            raise IndexError('more vertex normals than vertices')
+        vns = np.zeros_like(positions)
+        vns[:len(normals)] = normals
+
+        # (objfile.read gives back 0-based indices, already split
+        # into fans of triangles.)
+        if len(triangles) > 0 and (triangles.min() < 0 or 
+                                   triangles.max() >= len(positions)):
+            raise IndexError('face refers to a missing vertex')
+        return (positions, vns, triangles)
+
+    @classmethod
+    # scene.weld(positions,normals,triangles,tolerance):
+    #
+    # Welds together the vertices, of the arrays given by scene.parse,
+    # that lie within the given tolerance of one another (see
+    # weld_map in mesh.py).  Each cluster of them is replaced by its
+    # first vertex, keeping that vertex's normal, and the triangles
+    # are renumbered to match.  Triangles left with two corners at
+    # the same vertex are dropped.
+    #
+    # Returns the welded arrays, and the number of vertices merged
+    # away.
+    #
+    def weld(cls,positions,normals,triangles,tolerance):
+        with instrument.stage('weld'):
+            labels = weld_map(positions,tolerance)
+            kept = labels == np.arange(len(labels))
+            renumber = (np.cumsum(kept) - 1).astype(triangles.dtype)
+            triangles = renumber[labels][triangles]
+            whole = (triangles[:,0] != triangles[:,1]) \
+                    & (triangles[:,1] != triangles[:,2]) \
+                    & (triangles[:,2] != triangles[:,0])
+            merged = len(positions) - int(kept.sum())
+            if merged > 0:
+                print('Welded %d vertices, dropping %d faces'
+                      % (merged,len(triangles) - int(whole.sum())))
+            instrument.count('vertices welded',merged)
+            instrument.count('faces dropped',len(triangles)
+                                             - int(whole.sum()))
+        return (positions[kept], normals[kept], triangles[whole], merged)
 
-        for V in vertex.all_instances():
-            V.position = ORIGIN + scale * (V.position-center)
+    @classmethod
+    # scene.build(positions,normals,triangles,mesh=None):
+    #
+    # Adds the vertices and faces given by the arrays from scene.parse
+    # to the given mesh, or to the scene's, and links their half-edges
+    # to their twins.  Returns the id of the first new half-edge.
+    #
+    def build(cls,positions,normals,triangles,mesh=None):
+        M = cls.mesh if mesh is None else mesh
+        with instrument.stage('build'):
+            vertexi = M.add_vertices(positions,normals)
+
+            #### ADDS AN OFFSET vertexi FROM THE .OBJ INDEX!!! ####
+            first = M.add_triangles(triangles + vertexi)
+            edge.register_all(first,M)
+        return first
+
+    @classmethod
+    # scene.clear():
+    #
+    # Empties the scene, giving it a new mesh.
+    #
+    def clear(cls):
+        cls.mesh = mesh()
+
+    @classmethod
+    # scene.restore(arrays,vertexi,mesh=None):
+    #
+    # Rebuilds the vertices and faces of a file from the arrays saved
+    # in its cache by an earlier read, where vertexi is the number of
+    # vertices read before it into the mesh (or the scene's).  The
+    # twins of its edges are given, so they don't need to be looked up.
+    #
+    def restore(cls,arrays,vertexi,mesh=None):
+        M = cls.mesh if mesh is None else mesh
+        positions = arrays['positions']
+        if vertexi == 0:
+            # This file is the whole mesh, so it gets its own rebox.
+            center = arrays['rebox'][:3]
+            scale = arrays['rebox'][3]
+            positions = 0.0 + scale * (positions - center)
+
+        with instrument.stage('restore'):
+            M.add_vertices(positions,arrays['normals'])
+            first = M.add_triangles(arrays['triangles'] + vertexi)
+            twins = arrays['twins']
+            M.twin[first:] = np.where(twins >= 0, twins + first, -1)
+            M.relinked()
+
+        if vertexi > 0:
+            # Like a full read, re-smooth the earlier vertices and 
+            # rebox everything.
+            vertex.smooth_normals(np.arange(vertexi),mesh=M)
+            scene.rebox(M)
+
+    @classmethod
+    # scene.rebox(mesh=None):
+    #
+    # Rescales and centers the mesh, or the scene's.
+    #
+    def rebox(cls,mesh=None):
+        with instrument.stage('rebox'):
+            (cls.mesh if mesh is None else mesh).rebox()
 
     @classmethod
-    def compile(cls):
-        varray = []
-        narray = []
+    # scene.compile(buffers=False,indexed=False,mesh=None):
+    #
+    # Gives back the (vertices, normals, colors) of the scene's
+    # faces (or the given mesh's), ready to load into vertex buffers:
+    # the corners of each face in turn, 3 floats for each corner.
+    # These are lists, or, if buffers is set, contiguous float32
+    # arrays, which can be handed to glBufferData as they are.
+    #
+    # If indexed is set, gives back (vertices, normals, colors,
+    # indices) instead, for drawing with glDrawElements: float32
+    # arrays with 3 floats for each vertex of the scene, and an
+    # array of the vertex indices of the corners of each face.  The
+    # indices are uint16 if there are few enough vertices, and
+    # uint32 otherwise.
+    #
+    def compile(cls,buffers=False,indexed=False,mesh=None):
+        M = cls.mesh if mesh is None else mesh
+        with instrument.stage('compile'):
+            return cls.compile_arrays(buffers,indexed,M)
+
+    @classmethod
+    def compile_arrays(cls,buffers,indexed,M):
+
+        # Make sure every vertex has a normal.
+        M.compute_normals()
+
+        if indexed:
+            n = M.vertex_count()
+            varray = M.positions.astype(np.float32)
+            narray = M.normals.astype(np.float32)
+            carray = np.empty((n,3),dtype=np.float32)
+            if n > 0:
+                carray[:] = vertex(0,M).color().components()
+            itype = np.uint16 if n <= 1 << 16 else np.uint32
+            return (varray.ravel(),narray.ravel(),carray.ravel(),
+                    M.source.astype(itype))
+
+        # The corners of each face, in order, are the sources of its
+        # three edges.
+        corners = M.source
+        if buffers:
+            varray = np.take(M.positions.astype(np.float32),corners,axis=0)
+            narray = np.take(M.normals.astype(np.float32),corners,axis=0)
+            carray = np.empty((len(corners),3),dtype=np.float32)
+            if len(corners) > 0:
+                carray[:] = vertex(0,M).color().components()
+            return (varray.ravel(),narray.ravel(),carray.ravel())
+
+        varray = M.positions[corners].ravel().tolist()
+        narray = M.normals[corners].ravel().tolist()
         carray = []
-        for f in face.all_instances():
-            for i in [0,1,2]:
-                varray.extend(f.vertex(i).position.components())
-                narray.extend(f.vertex(i).normal().components())
-                carray.extend(f.vertex(i).color().components())
+        if len(corners) > 0:
+            carray = vertex(0,M).color().components() * len(corners)
         return (varray,narray,carray)
 
     @classmethod
-    def intersect_ray(self,R,d):
-        selected = None
-        dist = sys.float_info.min
-        for f in face.all_instances():
-            sect = f.intersect_ray(R,d)
-            if sect:
-                if sect[2] > dist:
-                    dist = sect[2]
-                    selected = f
-        return selected
+    # scene.compile_stream(filename,size=objfile.BATCH_SIZE):
+    #
+    # Compiles the .obj file with the given name straight from the
+    # file, without reading it into a mesh, giving back a generator of
+    # the (vertices, normals, colors) float32 buffers, as compile
+    # gives them with buffers set, for each batch of up to size of
+    # its faces in turn.
+    #
+    # The positions are reboxed just as a read reboxes them.  Each
+    # vertex's normal is the one given in the file, if any, or else
+    # the area weighted sum of its faces' normals.  These normals
+    # aren't smoothed, since that needs the whole mesh.
+    #
+    # The file is streamed through objfile's generators, so the
+    # memory used grows with the vertices of the file, but not its
+    # faces.
+    #
+    def compile_stream(cls,filename,size=objfile.BATCH_SIZE):
+
+        # Gather the vertices, and find their rebox.
+        positions = []
+        normals = []
+        for P, N, T in objfile.records(filename):
+            positions.append(P)
+            normals.append(N)
+        positions = np.concatenate(positions) if positions \
+                    else np.zeros((0,3))
+        normals = np.concatenate(normals) if normals else np.zeros((0,3))
+        if len(normals) > len(positions):
+            raise IndexError('more vertex normals than vertices')
+        vns = np.zeros_like(positions)
+        vns[:len(normals)] = unit(normals)
+        center, scale = rebox_transform(positions)
+        positions = 0.0 + scale * (positions - center)
+
+        # Sum the face normals of the vertices that weren't given one.
+        missing = np.ones(len(positions),dtype=bool)
+        missing[:len(normals)] = False
+        if missing.any():
+            sums = np.zeros((3,len(positions)))
+            for triangles in objfile.batches(filename,size):
+                if len(triangles) > 0 and (triangles.min() < 0 or
+                        triangles.max() >= len(positions)):
+                    raise IndexError('face refers to a missing vertex')
+                corners = positions[triangles]
+                weighted = cross(corners[:,1] - corners[:,0],
+                                 corners[:,2] - corners[:,0])
+                for j in range(3):
+                    for k in range(3):
+                        np.add.at(sums[j],triangles[:,k],weighted[:,j])
+            vns[missing] = unit(sums.T[missing])
+
+        varray = positions.astype(np.float32)
+        narray = vns.astype(np.float32)
+        color = vertex(0).color().components()
+        for triangles in objfile.batches(filename,size):
+            if len(triangles) > 0 and (triangles.min() < 0 or
+                                       triangles.max() >= len(positions)):
+                raise IndexError('face refers to a missing vertex')
+            corners = triangles.ravel()
+            carray = np.empty((len(corners),3),dtype=np.float32)
+            carray[:] = color
+            yield (np.take(varray,corners,axis=0).ravel(),
+                   np.take(narray,corners,axis=0).ravel(),
+                   carray.ravel())
+
+    @classmethod
+    # scene.closest_hit(R,d,mesh=None):
+    #
+    # Finds the face first hit by the ray from point R in direction
+    # d.  Returns [f,[a1,a2,a3],t], where f is that face, a1, a2, a3
+    # are the barycentric coordinates of the hit point on f, and t is
+    # the distance to it in multiples of d.  Returns None on a miss.
+    #
+    # This uses the bounding volume hierarchy of the mesh (or the
+    # scene's), which is built on the first call.
+    #
+    def closest_hit(cls,R,d,mesh=None):
+        M = cls.mesh if mesh is None else mesh
+        hit = M.bvh().intersect_ray(R.components(),d.components())
+        if hit is None:
+            return None
+        return [face(hit[0],M),hit[1],hit[2]]
+
+    @classmethod
+    # scene.intersect_ray(R,d,mesh=None):
+    #
+    # Returns the face first hit by the ray from point R in direction
+    # d, or None.
+    #
+    def intersect_ray(cls,R,d,mesh=None):
+        hit = cls.closest_hit(R,d,mesh)
+        if hit is None:
+            return None
+        return hit[0]
+
+    @classmethod
+    # scene.intersect_rays(origins,directions,mesh=None):
+    #
+    # Casts many rays at once.  The rays are given as an n x 3 array
+    # of origins and an n x 3 array of directions.  Returns the
+    # arrays (faces, distances, barycentrics): the id of the face
+    # each ray first hits (-1 for a miss), the distance to the hit
+    # in multiples of the ray's direction (inf for a miss), and the
+    # hit point's barycentric coordinates on that face.
+    #
+    def intersect_rays(cls,origins,directions,mesh=None):
+        M = cls.mesh if mesh is None else mesh
+        return M.bvh().intersect_rays(origins,directions)
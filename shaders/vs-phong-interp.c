@@ -6,6 +6,7 @@ attribute vec3 color;    // material properties of the surface at location
 
 uniform vec3 light;      // position of a point light source
 uniform vec3 eye;        // position of the eyepoint
+uniform mat4 modelview;  // rotation of the trackball
 
 varying vec3 n;
 varying vec3 P;
@@ -15,5 +16,5 @@ void main() {
   n = normal;
   P = vertex;
   material_c = color;
-  gl_Position = gl_ProjectionMatrix*gl_ModelViewMatrix*vec4(P,1.0);
+  gl_Position = gl_ProjectionMatrix*modelview*vec4(P,1.0);
 }
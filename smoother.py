@@ -0,0 +1,107 @@
+#
+# smoother.py
+#
+# Defines class smoother, the normal smoothing of vertex.smooth_normals
+# expressed as a sparse linear operator on the array of vertex normals.
+#
+# One smoothing pass replaces the normal n of each vertex with the unit
+# vector in the direction of
+#
+#     sum over its fan edges of (a n + b n_i)
+#
+# where n_i is the normal of the neighbor at the far end of the edge.
+# With a = b = 1 this is the d n + sum n_i of vertex.smooth_normals,
+# d being the vertex's degree.
+#
+# The operator is built once from the mesh's connectivity, as a list
+# of (row, column, weight) entries, two for each step of each vertex's
+# fan.  Applying it sums weight * normals[column] into each row with
+# np.bincount, which adds the entries up in order, and so gives just
+# the sums the fan loop gives.
+#
+
+import numpy as np
+from mesh import unit
+
+class smoother:
+
+    #
+    # smoother(mesh,damping=0.5,crease=None):
+    #
+    # Builds the smoothing operator for the given mesh.  The damping
+    # weight is the share of each vertex's own normal kept in a pass,
+    # with the rest coming from its neighbors.  The default of 0.5
+    # gives the smoothing of vertex.smooth_normals.
+    #
+    # If a crease angle (in radians) is given, then an edge whose two
+    # faces meet at a greater angle than that is left out, so normals
+    # are not smoothed across it.  A vertex with all its edges left
+    # out keeps its normal.
+    #
+    # Instance attributes:
+    #
+    #   * rows, columns, weights: the entries of the operator
+    #   * size: the number of vertices it applies to
+    #
+    def __init__(self,mesh,damping=0.5,crease=None):
+        self.size = mesh.vertex_count()
+        centers, edges = mesh.fans()
+        neighbors = mesh.source[mesh.next[edges]]
+
+        lone = np.zeros(0,dtype=np.int64)
+        if crease is not None:
+            # Measure the angle between the faces on either side of
+            # each edge.  Border edges have just the one face.
+            mesh.compute_face_normals()
+            normals = unit(mesh.face_normals)
+            twins = mesh.twin[edges]
+            across = np.where(twins >= 0, mesh.face[np.maximum(twins,0)],
+                              mesh.face[edges])
+            cosines = (normals[mesh.face[edges]] * normals[across]).sum(axis=1)
+            kept = cosines >= np.cos(crease)
+            lone = np.setdiff1d(centers,centers[kept])
+            centers = centers[kept]
+            neighbors = neighbors[kept]
+
+        self.rows = np.concatenate([np.repeat(centers,2),lone])
+        self.columns = np.concatenate([
+            np.stack([centers,neighbors],axis=1).ravel(),lone])
+        self.weights = np.concatenate([
+            np.tile([2.0*damping,2.0*(1.0-damping)],len(centers)),
+            np.ones(len(lone))])
+
+    #
+    # self.apply(normals,vertices=None):
+    #
+    # Runs one smoothing pass over an n x 3 array of normals, giving
+    # back the smoothed array.  If an array of vertex ids is given,
+    # only those vertices' normals change.
+    #
+    def apply(self,normals,vertices=None):
+        rows, columns, weights = self.rows, self.columns, self.weights
+        if vertices is not None:
+            chosen = np.zeros(self.size,dtype=bool)
+            chosen[vertices] = True
+            keep = chosen[rows]
+            rows, columns, weights = rows[keep], columns[keep], weights[keep]
+
+        sums = np.empty((self.size,3))
+        for j in range(3):
+            sums[:,j] = np.bincount(rows,weights * normals[columns,j],
+                                    minlength=self.size)
+        if vertices is None:
+            return unit(sums)
+        smoothed = normals.copy()
+        smoothed[vertices] = unit(sums[vertices])
+        return smoothed
+
+    #
+    # self.smooth(normals,passes=1,vertices=None):
+    #
+    # Runs the given number of smoothing passes over an n x 3 array
+    # of normals, giving back the smoothed array.
+    #
+    def smooth(self,normals,passes=1,vertices=None):
+        for i in range(passes):
+            normals = self.apply(normals,vertices)
+        return normals